@@ -4,13 +4,10 @@ import re
 import sys
 import os
 import pprint
-import boto
-from boto.ec2.image import Image
-from boto.ec2.instance import Reservation
-from boto.ec2.volume import Volume
-from boto.ec2.blockdevicemapping import BlockDeviceMapping, BlockDeviceType
+import socket
+from multiprocessing.pool import ThreadPool
 
-from eutester.euinstance import EuInstance
+from eutester import sshconnection
 
 
 class Eucaops(Eutester):
@@ -506,6 +503,7 @@ class Eucaops(Eutester):
         windows        (optional boolean) Is windows image boolean
         kernel         (optional string) kernal (note for windows this name should be "windows"
         '''
+        from boto.ec2.blockdevicemapping import BlockDeviceMapping, BlockDeviceType
         
         if (bdmdev is None):
             bdmdev=rdn
@@ -719,6 +717,7 @@ class Eucaops(Eutester):
         return self.convert_reservation_to_euinstance(reservation, keypath)
     
     def convert_reservation_to_euinstance(self, reservation, keypath=None):
+        from eutester.euinstance import EuInstance
         euinstance_list = []
         for instance in reservation.instances:
             try:
@@ -729,6 +728,111 @@ class Eucaops(Eutester):
         reservation.instances = euinstance_list
         return reservation
     
+    def sys_on_instances(self, instances, cmd, timeout=120, verbose=False):
+        """
+        Run a command on many EuInstances at once from a single thread and return a dictionary of results keyed by instance id
+        instances  list of EuInstance objects (ie reservation.instances after convert_reservation_to_euinstance)
+        cmd        command to run on every instance, or a dictionary of instance id => command
+        timeout    overall time in seconds allowed for every instance to complete
+        Each result is a dictionary with the keys: host, cmd, output, status (exit code), elapsed and error
+        """
+        mux = sshconnection.SshMultiplexer(debugmethod=self.debug, verbose=verbose)
+        for instance in instances:
+            if isinstance(cmd, dict):
+                mux.add(instance.ssh, cmd[instance.id])
+            else:
+                mux.add(instance.ssh, cmd)
+        results = mux.run(timeout=timeout)
+        return dict(zip([instance.id for instance in instances], results))
+    
+    def probe_ssh(self, instance, keypath=None, password=None, username="root", timeout=600, port=22, max_interval=16):
+        """
+        Poll a single instance until it accepts ssh logins, backing off exponentially between attempts
+        Each attempt checks, in order: that the instance has an address, that the port accepts a tcp connection,
+        that an ssh banner is returned, and finally that we can authenticate.
+        Returns an EuInstance with an authenticated ssh connection, or None if the instance was not ready before timeout
+        instance      boto instance object to probe
+        keypath       path to the private key to log in with
+        password      password to log in with if no keypath is given
+        timeout       seconds to keep probing before giving up
+        max_interval  upper bound in seconds for the backoff between attempts
+        """
+        from eutester.euinstance import EuInstance
+        euinstance = EuInstance.make_euinstance_from_instance(instance, keypath=keypath, password=password, username=username)
+        if euinstance.ssh is None:
+            self.critical("Instance(" + instance.id + ") can not be probed, no ssh credentials given")
+            return None
+        ### Probes run in worker threads, refresh the instance through this thread's own EC2 connection rather than the
+        ### one connection it was fetched with. The EuInstance shares the instance's attributes so put it back afterwards
+        instance_connection = euinstance.connection
+        euinstance.connection = self.ec2
+        try:
+            start = time.time()
+            deadline = start + timeout
+            interval = 1
+            attempts = 0
+            last_error = None
+            while time.time() < deadline:
+                attempts += 1
+                try:
+                    if (euinstance.ip_address is None) or (euinstance.ip_address == "0.0.0.0"):
+                        euinstance.update()
+                        raise Exception("instance has no address yet")
+                    sock = socket.create_connection((euinstance.ip_address, port), timeout=min(5, max(1, deadline - time.time())))
+                    try:
+                        banner = sock.recv(256)
+                    finally:
+                        sock.close()
+                    if not banner.startswith("SSH-"):
+                        raise Exception("no ssh banner received")
+                    ### Only rebuild the ssh session if the instance's address has changed since it was made
+                    if euinstance.ssh.host != euinstance.ip_address:
+                        euinstance.update_ssh()
+                    euinstance.ssh.connect()
+                    self.debug("Instance(" + instance.id + ") ssh ready after " + str(attempts) + " attempts, " + str(round(time.time() - start, 2)) + " seconds")
+                    return euinstance
+                except Exception, e:
+                    last_error = str(e)
+                self.sleep(min(interval, max(0, deadline - time.time())))
+                interval = min(interval * 2, max_interval)
+            self.critical("Instance(" + instance.id + ") was not ssh ready after " + str(attempts) + " attempts: " + str(last_error))
+            return None
+        finally:
+            euinstance.connection = instance_connection
+    
+    def iter_ssh_ready(self, reservation, keypath=None, password=None, username="root", timeout=600, workers=20):
+        """
+        Probe every instance in the reservation at the same time and yield each EuInstance as soon as it accepts ssh logins
+        Instances that never become reachable within timeout are logged and not yielded
+        reservation   boto reservation whose instances should be probed
+        keypath       path to the private key to log in with
+        password      password to log in with if no keypath is given
+        timeout       seconds to keep probing each instance
+        workers       maximum number of instances probed at the same time
+        """
+        instances = reservation.instances
+        if len(instances) == 0:
+            return
+        pool = ThreadPool(min(workers, len(instances)))
+        try:
+            probe = lambda instance: self.probe_ssh(instance, keypath=keypath, password=password, username=username, timeout=timeout)
+            for euinstance in pool.imap_unordered(probe, instances):
+                if euinstance is not None:
+                    yield euinstance
+        finally:
+            pool.close()
+            pool.join()
+    
+    def wait_for_ssh_ready(self, reservation, keypath=None, password=None, username="root", timeout=600, workers=20):
+        """
+        Probe every instance in the reservation at the same time and return the list of EuInstances that accepted ssh logins
+        Fails the test step if any instance did not become reachable
+        """
+        ready = list(self.iter_ssh_ready(reservation, keypath=keypath, password=password, username=username, timeout=timeout, workers=workers))
+        if len(ready) < len(reservation.instances):
+            self.fail(str(len(reservation.instances) - len(ready)) + " of " + str(len(reservation.instances)) + " instances in " + str(reservation) + " never accepted ssh logins")
+        return ready
+    
     def get_instances(self, 
                       state=None, 
                       idstring=None, 
@@ -883,6 +987,7 @@ class Eucaops(Eutester):
                 for instance in res.instances:
                     self.debug( "Sending terminate for " + str(instance) )
                     instance.terminate()
+                    self.close_instance_ssh(instance)
                 if self.wait_for_reservation(res, state="terminated") is False:
                     aggregate_result = False
         ### Otherwise just kill this reservation
@@ -890,10 +995,18 @@ class Eucaops(Eutester):
             for instance in reservation.instances:
                     self.debug( "Sending terminate for " + str(instance) )
                     instance.terminate()
+                    self.close_instance_ssh(instance)
             if self.wait_for_reservation(reservation, state="terminated") is False:
                 aggregate_result = False
         return aggregate_result
     
+    def close_instance_ssh(self, instance):
+        """
+        Release the ssh session of an instance (set when it was made into an EuInstance) so its pooled transport is closed
+        """
+        if getattr(instance, "ssh", None) is not None:
+            instance.ssh.close()
+    
     def stop_instances(self,reservation):
         for instance in reservation.instances:
             self.debug( "Sending stop for " + str(instance) )
@@ -954,6 +1067,9 @@ class Eucaops(Eutester):
             raise
     
     def cleanup_artifacts(self):
+        from boto.ec2.image import Image
+        from boto.ec2.instance import Reservation
+        from boto.ec2.volume import Volume
         self.debug("Starting cleanup of artifacts")
         for key,array in self.test_resources.iteritems():
             for item in array:
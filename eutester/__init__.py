@@ -39,20 +39,30 @@ import re
 import os
 import subprocess
 import threading
-import paramiko
-import select
-import boto
 import random
 import time
 import signal
 import copy 
+import zlib
+import tempfile
 from threading import Thread
+from multiprocessing.pool import ThreadPool
 
-from boto.ec2.regioninfo import RegionInfo
-from boto.s3.connection import OrdinaryCallingFormat
 
 from machine import machine
 import eulogger
+import sshconnection
+import sftptransfer
+import credcache
+from eucarc import Eucarc
+from localshell import LocalShell
+from botopool import BotoConnectionPool
+from topology import Topology
+from logtailer import LogTailer
+from logcapture import LogCapture
+from logstore import LogStore
+from logarchive import LogArchive
+import euconfig
 from euservice import EuserviceManager
 
 
@@ -61,6 +71,21 @@ class TimeoutFunctionException(Exception):
     pass 
 
 class Eutester(object):
+    ### Number of hosts connected to at the same time while bootstrapping from a config file
+    bootstrap_workers = 20
+    ### Reuse credentials from the local credential cache instead of downloading them from the CLC every run
+    use_credential_cache = True
+    ### Maximum number of boto connections per service checked out of get_boto_pool() at once
+    boto_pool_size = 10
+    ### Directory captured euca logs are written to, None makes a new euca-logs-<time>-<pid> directory in the system temp dir
+    euca_log_dir = None
+    ### Bytes of each captured euca log kept in memory, the rest is only on disk under euca_log_dir
+    euca_log_tail_bytes = 1024*1024
+    ### Size at which captured euca logs start a new segment file on disk
+    euca_log_segment_bytes = 64*1024*1024
+    ### Component whose log the old cloud/walrus/cc/sc/nc_log_buffer attributes return
+    legacy_euca_logs = {"cloud": "clc", "walrus": "ws", "cc": "cc00", "sc": "sc00", "nc": "nc00"}
+    
     def __init__(self, config_file=None, password=None, keypath=None, credpath=None, aws_access_key_id=None, aws_secret_access_key = None, account="eucalyptus",  user="admin", boto_debug=0):
         """  
         EUCADIR => $eucadir, 
@@ -84,10 +109,13 @@ class Eutester(object):
         self.current_ssh = "clc"
         self.boto_debug = boto_debug
         self.ssh = None
-        self.sftp = None
         self.password = password
         self.keypath = keypath
         self.credpath = credpath
+        self.eucarc = None
+        self.local_shell = None
+        self.boto_pools = {}
+        self.topology = Topology()
         self.timeout = 30
         self.delay = 0
         self.exit_on_fail = 0
@@ -98,12 +126,13 @@ class Eutester(object):
         self.hypervisor = None
         
         ##### Euca Logs 
-        self.cloud_log_buffer = ''
-        self.cc_log_buffer  = ''
-        self.nc_log_buffer = ''
-        self.sc_log_buffer = ''
-        self.walrus_log_buffer = ''
+        self.log_captures = {}
+        self.log_store = LogStore()
+        self.euca_log_marks = {}
+        self.log_archives = {}
+        self.euca_log_saved = {}
         self.logging_thread = False
+        self.log_tailer = None
         
         ### Eutester logs
         self.logger = eulogger.Eulogger(identifier="localhost")
@@ -121,6 +150,8 @@ class Eutester(object):
         self.nc_log_channel= None
         
         self.clc_index = 0
+        self.unreachable_machines = []
+        self.credential_cache = credcache.CredentialCache()
 
         ### If I have a config file
         ### PRIVATE CLOUD
@@ -128,6 +159,8 @@ class Eutester(object):
             ## read in the config file
             self.debug("Reading config file: " + config_file)
             self.config = self.read_config(config_file)
+            self.topology = self.config["topology"]
+            self.connect_machines(self.config["machines"])
             ### Set the eucapath
             if "REPO" in self.config["machines"][0].source:
                 self.eucapath="/"
@@ -141,11 +174,9 @@ class Eutester(object):
                 if self.credpath is None:
                     ### TRY TO GET CREDS ON FIRST CLC if it fails try on second listed clc, if that fails weve hit a terminal condition
                     try:
-                        self.sftp = self.clc.ssh.connection.open_sftp()
                         self.credpath = self.get_credentials(account,user)
                     except Exception, e:
                         self.swap_clc()
-                        self.sftp = self.clc.ssh.connection.open_sftp()
                         self.credpath = self.get_credentials(account,user)
                 self.service_manager = EuserviceManager(self)
                 self.clc = self.service_manager.get_enabled_clc().machine
@@ -157,29 +188,79 @@ class Eutester(object):
                     
         ### If you have credentials for the boto connections, create them
         if (aws_access_key_id != None) and (aws_secret_access_key != None):
-           self.ec2 = boto.connect_ec2(aws_access_key_id=aws_access_key_id,
-                                        aws_secret_access_key=aws_secret_access_key,
-                                        is_secure=False,
-                                        api_version = '2009-11-30',
-                                        region=RegionInfo(name="eucalyptus", endpoint=self.get_clc_ip()),
-                                        port=8773,
-                                        path="/services/Eucalyptus",
-                                        debug=self.boto_debug)
-           self.walrus = boto.connect_s3(aws_access_key_id=aws_access_key_id,
-                                          aws_secret_access_key=aws_secret_access_key,
-                                          is_secure=False,
-                                          host=self.get_walrus_ip(),
-                                          port=8773,
-                                          path="/services/Walrus",
-                                          calling_format=OrdinaryCallingFormat(),
-                                          debug=self.boto_debug)
-           self.euare = boto.connect_iam(aws_access_key_id=aws_access_key_id,
-                                          aws_secret_access_key=aws_secret_access_key,
-                                          is_secure=False,
-                                          host=self.get_clc_ip(),
-                                          port=8773,
-                                          path="/services/Euare",
-                                          debug=self.boto_debug)
+            self.setup_boto_connections(aws_access_key_id, aws_secret_access_key)
+    
+    def setup_boto_connections(self, aws_access_key_id, aws_secret_access_key):
+        """ Create the ec2, walrus and euare boto connection pools using the keys passed in and the endpoints from the eucarc
+            Each thread that uses self.ec2, self.walrus or self.euare gets its own connection, worker pools can also check
+            connections out of a bounded pool of self.boto_pool_size with: 
+            with tester.get_boto_pool("ec2").connection() as ec2:
+                ec2.get_all_instances()
+            boto is imported by the first connection made, not when eutester is imported
+        """
+        eucarc = self.get_eucarc()
+        s3_endpoint = eucarc.s3_endpoint
+        euare_endpoint = eucarc.euare_endpoint
+        def connect_ec2():
+            return self.create_ec2_connection(eucarc, aws_access_key_id, aws_secret_access_key)
+        def connect_walrus():
+            import boto
+            from boto.s3.connection import OrdinaryCallingFormat
+            return boto.connect_s3(aws_access_key_id=aws_access_key_id,
+                                   aws_secret_access_key=aws_secret_access_key,
+                                   is_secure=s3_endpoint["is_secure"],
+                                   host=s3_endpoint["host"],
+                                   port=s3_endpoint["port"],
+                                   path=s3_endpoint["path"],
+                                   calling_format=OrdinaryCallingFormat(),
+                                   debug=self.boto_debug)
+        def connect_euare():
+            import boto
+            return boto.connect_iam(aws_access_key_id=aws_access_key_id,
+                                    aws_secret_access_key=aws_secret_access_key,
+                                    is_secure=euare_endpoint["is_secure"],
+                                    host=euare_endpoint["host"],
+                                    port=euare_endpoint["port"],
+                                    path=euare_endpoint["path"],
+                                    debug=self.boto_debug)
+        self.boto_pools = {"ec2": BotoConnectionPool(connect_ec2, size=self.boto_pool_size),
+                           "walrus": BotoConnectionPool(connect_walrus, size=self.boto_pool_size),
+                           "euare": BotoConnectionPool(connect_euare, size=self.boto_pool_size)}
+    
+    def create_ec2_connection(self, eucarc, aws_access_key_id, aws_secret_access_key):
+        """ Returns a new EC2 boto connection to the endpoint in the Eucarc eucarc using the keys passed in """
+        import boto
+        from boto.ec2.regioninfo import RegionInfo
+        ec2_endpoint = eucarc.ec2_endpoint
+        return boto.connect_ec2(aws_access_key_id=aws_access_key_id,
+                                aws_secret_access_key=aws_secret_access_key,
+                                is_secure=ec2_endpoint["is_secure"],
+                                api_version = '2009-11-30',
+                                region=RegionInfo(name="eucalyptus", endpoint=ec2_endpoint["host"]),
+                                port=ec2_endpoint["port"],
+                                path=ec2_endpoint["path"],
+                                debug=self.boto_debug)
+    
+    def get_boto_pool(self, service):
+        """ Returns the BotoConnectionPool for service, one of "ec2", "walrus" or "euare" """
+        if service not in self.boto_pools:
+            raise AttributeError("No " + service + " connection has been set up, credentials were not provided")
+        return self.boto_pools[service]
+    
+    @property
+    def ec2(self):
+        """ EC2 boto connection owned by the calling thread"""
+        return self.get_boto_pool("ec2").get()
+    
+    @property
+    def walrus(self):
+        """ S3 boto connection to Walrus owned by the calling thread"""
+        return self.get_boto_pool("walrus").get()
+    
+    @property
+    def euare(self):
+        """ IAM boto connection to Euare owned by the calling thread"""
+        return self.get_boto_pool("euare").get()
     
     def __del__(self):
         self.logging_thread = False
@@ -217,46 +298,89 @@ class Eutester(object):
                 SC00 - Storage controller for cluster 00   
                 CC00 - Cluster controller for cluster 00    
                 NC00 - A node controller in cluster 00   
+            
+            Structured configs
+            ------------------
+            A config file ending in .json, .yaml or .yml (or starting with "{") is read as a structured config, 
+            which can also set a per host ssh_port, username, password, keypath, max_sessions and log_paths. 
+            See euconfig for the format, euconfig.convert_legacy_config() converts an existing config file. 
+            Configs are validated when loaded and every problem found is reported in one exception.
         """
-        config_hash = {}
-        machines = []
-        f = None
         try:
-            f = open(filepath, 'r')
+            config = euconfig.load_config(filepath)
         except IOError as (errno, strerror):
             self.debug( "ERROR: Could not find config file " + self.config_file)
             raise
-            
-        for line in f:
-            ### LOOK for the line that is defining a machine description
-            line = line.strip()
-            re_machine_line = re.compile(".*\[.*]")
-            if re_machine_line.match(line):
-                #print "Matched Machine :" + line
-                machine_details = line.split(None, 5)
-                machine_dict = {}
-                machine_dict["hostname"] = machine_details[0]
-                machine_dict["distro"] = machine_details[1]
-                machine_dict["distro_ver"] = machine_details[2]
-                machine_dict["arch"] = machine_details[3]
-                machine_dict["source"] = machine_details[4]
-                machine_dict["components"] = map(str.lower, machine_details[5].strip('[]').split())
-                ### ADD the machine to the array of machine
-                cloud_machine = machine(   machine_dict["hostname"], 
-                                        machine_dict["distro"], 
-                                        machine_dict["distro_ver"], 
-                                        machine_dict["arch"], 
-                                        machine_dict["source"], 
-                                        machine_dict["components"],
-                                        self.password,
-                                        self.keypath
-                                        )
-                machines.append(cloud_machine)
-            if re.search("network",line, re.IGNORECASE):
-                config_hash["network"] = line.split()[1].lower()
+        config_hash = {}
+        machines = []
+        for machine_dict in config["machines"]:
+            ### Per host credentials in the config override the ones given to the tester
+            password = machine_dict["password"]
+            keypath = machine_dict["keypath"]
+            if (password is None) and (keypath is None):
+                password = self.password
+                keypath = self.keypath
+            cloud_machine = machine(   machine_dict["hostname"], 
+                                    machine_dict["distro"], 
+                                    machine_dict["distro_ver"], 
+                                    machine_dict["arch"], 
+                                    machine_dict["source"], 
+                                    machine_dict["components"],
+                                    password,
+                                    keypath,
+                                    username=machine_dict["username"],
+                                    port=machine_dict["ssh_port"],
+                                    max_sessions=machine_dict["max_sessions"],
+                                    log_paths=machine_dict["log_paths"]
+                                    )
+            machines.append(cloud_machine)
+        if config["network"] is not None:
+            config_hash["network"] = config["network"]
         config_hash["machines"] = machines 
+        config_hash["topology"] = Topology(machines)
         return config_hash
     
+    def connect_machines(self, machines, workers=None):
+        """ Establish the ssh sessions to a list of machines concurrently using a bounded pool of worker threads
+            Hosts that fail to connect are reported and added to self.unreachable_machines without stopping the others
+            Prints a summary of the time each host took to connect
+            Returns a dictionary of hostname => {"elapsed": seconds, "error": None or the error string}
+        """
+        if workers is None:
+            workers = self.bootstrap_workers
+        if len(machines) == 0:
+            return {}
+
+        def connect_machine(machine):
+            start = time.time()
+            try:
+                machine.connect()
+                error = None
+            except Exception, e:
+                error = str(e)
+            return machine, {"elapsed": time.time() - start, "error": error}
+
+        start = time.time()
+        pool = ThreadPool(min(workers, len(machines)))
+        try:
+            connected = pool.map(connect_machine, machines)
+        finally:
+            pool.close()
+            pool.join()
+        results = {}
+        summary = "Connected to " + str(len(machines)) + " machines in " + str(round(time.time() - start, 2)) + " seconds\n"
+        for machine, result in sorted(connected, key=lambda item: item[1]["elapsed"], reverse=True):
+            results[machine.hostname] = result
+            if result["error"] is None:
+                summary += "    " + machine.hostname.ljust(40) + str(round(result["elapsed"], 2)) + "s\n"
+            else:
+                summary += "    " + machine.hostname.ljust(40) + "FAILED after " + str(round(result["elapsed"], 2)) + "s: " + result["error"] + "\n"
+                if machine not in self.unreachable_machines:
+                    self.unreachable_machines.append(machine)
+                self.critical("Unable to connect to " + machine.hostname + ": " + result["error"])
+        self.debug(summary)
+        return results
+    
     def get_network_mode(self):
         return self.config['network']
     
@@ -280,33 +404,28 @@ class Eutester(object):
         
             
     def get_component_ip(self, component):
-        """ Parse the machine list and a bm_machine object for a machine that matches the component passed in"""
-        #loop through machines looking for this component type
-        component.lower()
-        machines_with_role = [machine.hostname for machine in self.config['machines'] if component in machine.components]
-        if len(machines_with_role) == 0:
-            raise Exception("Could not find component "  + component + " in list of machines")
-        else:
-             return machines_with_role[0]
+        """ Returns the hostname of the first machine in the config running the component passed in"""
+        return self.get_component_machines(component)[0].hostname
     
     def get_machine_by_ip(self, hostname):
-         machines = [machine for machine in self.config['machines'] if re.search(hostname, machine.hostname)]
-         if len(machines) == 0:
+        """ Returns the machine whose hostname is exactly hostname (or resolves to the address hostname)"""
+        machine = self.topology.get_machine(hostname)
+        if machine is None:
             self.fail("Could not find machine at "  + hostname + " in list of machines")
-            return None
-         else:
-             return machines[0]
+        return machine
          
     def get_component_machines(self, component):
-        #loop through machines looking for this component type
-        """ Parse the machine list and a list of bm_machine objects that match the component passed in"""
-        component.lower()
-        machines_with_role = [machine for machine in self.config['machines'] if component in machine.components]
+        """ Returns the list of machine objects running the component passed in"""
+        machines_with_role = self.topology.get_component_machines(component)
         if len(machines_with_role) == 0:
             raise Exception("Could not find component "  + component + " in list of machines")
         else:
              return machines_with_role
 
+    def get_partition_machines(self, partition):
+        """ Returns the list of machine objects running a component in the partition passed in, ie "PARTI00" or "00" """
+        return self.topology.get_partition_machines(partition)
+
     def swap_component_hostname(self, hostname):
         if hostname != None:
             if len(hostname) < 5:
@@ -314,11 +433,22 @@ class Eutester(object):
                 hostname = component_hostname
         return hostname
        
-    def get_credentials(self, account="eucalyptus", user="admin"):
+    def get_credentials(self, account="eucalyptus", user="admin", use_cache=None):
         """Login to the CLC and download credentials programatically for the user and account passed in
            Defaults to admin@eucalyptus 
+           Unless use_cache is False (defaults to self.use_credential_cache) credentials are first looked up in the local 
+           credential cache and only downloaded when there is no cached copy or the API rejects the cached access key
         """
         admin_cred_dir = "eucarc-" + account + "-" + user
+        if use_cache is None:
+            use_cache = self.use_credential_cache
+        cloud = self.get_cloud_id()
+        if use_cache and self.credential_cache.restore(cloud, account, user, admin_cred_dir):
+            if self.validate_credentials(admin_cred_dir):
+                self.debug("Using cached credentials for " + user + "@" + account + " on " + cloud)
+                return admin_cred_dir
+            self.debug("Cached credentials for " + user + "@" + account + " were rejected, downloading new credentials")
+            self.credential_cache.invalidate(cloud, account, user)
         
         ### SETUP directory remotely
         self.sys("rm -rf " + admin_cred_dir)
@@ -337,127 +467,384 @@ class Eutester(object):
         os.mkdir(admin_cred_dir)
         
         ### DOWNLOAD creds from clc
-        self.sftp.get(admin_cred_dir + "/creds.zip" , admin_cred_dir + "/creds.zip")
+        self.clc.get_file(admin_cred_dir + "/creds.zip" , admin_cred_dir + "/creds.zip")
         os.system("unzip -o " + admin_cred_dir + "/creds.zip -d " + admin_cred_dir )
+        if use_cache:
+            self.credential_cache.store(cloud, account, user, admin_cred_dir)
         return admin_cred_dir
+    
+    def get_cloud_id(self):
+        """Returns a string identifying this cloud for the credential cache, made up of the CLC hostnames in the config"""
+        return ",".join(sorted([machine.hostname for machine in self.get_component_machines("clc")]))
+    
+    def validate_credentials(self, credpath):
+        """Check the access key in the eucarc at credpath against the cloud with a cheap API call, returns True if it was accepted
+           A throwaway connection is used, the tester's own credentials and boto connections are left as they are
+        """
+        try:
+            eucarc = Eucarc(os.path.join(credpath, "eucarc"))
+            self.create_ec2_connection(eucarc, eucarc.access_key, eucarc.secret_key).get_all_zones()
+            return True
+        except Exception, e:
+            self.debug("Credentials at " + credpath + " failed validation: " + str(e))
+            return False
         
     def get_access_key(self):
         """Parse the eucarc for the EC2_ACCESS_KEY"""
-        return self.parse_eucarc("EC2_ACCESS_KEY")   
+        return self.get_eucarc().access_key   
     
     def get_secret_key(self):
        """Parse the eucarc for the EC2_SECRET_KEY"""
-       return self.parse_eucarc("EC2_SECRET_KEY")
+       return self.get_eucarc().secret_key
     
     def get_account_id(self):
         """Parse the eucarc for the EC2_ACCOUNT_NUMBER"""
-        return self.parse_eucarc("EC2_ACCOUNT_NUMBER")
+        return self.get_eucarc().account_id
         
+    def get_eucarc(self):
+        """Returns the parsed Eucarc for the current credpath, it is only re-read from disk when the file changes"""
+        path = os.path.join(self.credpath, "eucarc")
+        if (self.eucarc is None) or (self.eucarc.path != path):
+            self.eucarc = Eucarc(path)
+        return self.eucarc
+    
     def parse_eucarc(self, field):
-        with open( self.credpath + "/eucarc") as eucarc:
-            for line in eucarc.readlines():
-                if re.search(field, line):
-                    return line.split("=")[1].strip().strip("'")
-            raise Exception("Unable to find account id in eucarc")
+        """Returns the value of field from the eucarc"""
+        return self.get_eucarc().get(field)
     
     def get_walrus_ip(self):
         """Parse the eucarc for the S3_URL"""
-        walrus_url = self.parse_eucarc("S3_URL")
-        return walrus_url.split("/")[2].split(":")[0]
+        return self.get_eucarc().s3_endpoint["host"]
     
     def get_clc_ip(self):
         """Parse the eucarc for the EC2_URL"""
-        ec2_url = self.parse_eucarc("EC2_URL")
-        return ec2_url.split("/")[2].split(":")[0]        
+        return self.get_eucarc().ec2_endpoint["host"]
         
     def create_ssh(self, hostname, password=None, keypath=None, username="root"):
-        """ Returns a paramiko SSHClient object for the hostname provided, either keypath or password must be provided"""
+        """ Returns a paramiko SSHClient object for the hostname provided, either keypath or password must be provided
+            The client comes from the shared ssh connection pool so it may already be in use by a machine object,
+            hand it back with sshconnection.connection_pool.release(client) when done so it can be closed once unused
+        """
         hostname = self.swap_component_hostname(hostname)
-        client = paramiko.SSHClient()
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())            
         if keypath == None:
             if password==None:
                 password= self.password
-            client.connect(hostname, username=username, password=password)
+        port = 22
+        if hostname in self.topology.by_host:
+            port = self.topology.by_host[hostname].ssh.port
+        return sshconnection.connection_pool.get(hostname, username=username, password=password, keypath=keypath, debugmethod=self.debug, port=port)
+    
+    def get_euca_log_paths(self, log_machine):
+        """ Returns a dictionary of component => path of the log collected for each component running on log_machine
+            Paths set for the machine with log_paths in the config are used first, then the standard log of the component
+        """
+        logdir = self.eucapath + "/var/log/eucalyptus/"
+        paths = {}
+        for component in log_machine.components:
+            if component in log_machine.log_paths:
+                paths[component] = log_machine.log_paths[component]
+            elif component.startswith("cc"):
+                paths[component] = logdir + "cc.log"
+            elif component.startswith("nc"):
+                paths[component] = logdir + "nc.log"
+            else:
+                paths[component] = logdir + "cloud-output.log"
+        return paths
+    
+    def get_euca_log_name(self, log_machine, path):
+        """ Returns the name the log at path on log_machine is captured and saved under, ie "192.168.1.10-cloud-output" """
+        return log_machine.hostname + "-" + os.path.splitext(os.path.basename(path))[0]
+    
+    def get_component_euca_logs(self, component):
+        """ Returns the names of the captured logs holding the log of component (ie "nc00") on each machine running it"""
+        names = []
+        for log_machine in self.topology.get_component_machines(component):
+            path = self.get_euca_log_paths(log_machine)[component.lower()]
+            names.append(self.get_euca_log_name(log_machine, path))
+        return names
+    
+    def get_euca_log_capture(self, name):
+        """ Returns the LogCapture holding the log name, creating it (and self.euca_log_dir) if needed"""
+        if name not in self.log_captures:
+            if self.euca_log_dir is None:
+                self.euca_log_dir = os.path.join(tempfile.gettempdir(), "euca-logs-" + time.strftime("%Y%m%d-%H%M%S") + "-" + str(os.getpid()))
+                self.debug("Capturing Eucalyptus logs to " + self.euca_log_dir)
+            self.log_captures[name] = LogCapture(name, self.euca_log_dir, tail_bytes=self.euca_log_tail_bytes, segment_bytes=self.euca_log_segment_bytes)
+        return self.log_captures[name]
+    
+    def get_euca_log_tail(self, name):
+        """ Returns the most recent data captured from the log name (up to euca_log_tail_bytes), or '' if nothing has been captured"""
+        if (name not in self.log_captures) and (name in self.legacy_euca_logs):
+            for component_log in self.get_component_euca_logs(self.legacy_euca_logs[name]):
+                if component_log in self.log_captures:
+                    name = component_log
+                    break
+        if name not in self.log_captures:
+            return ''
+        return self.log_captures[name].get_tail()
+    
+    def capture_euca_log(self, name, data):
+        """ Called by the log tailer with each block of data read from the log name, the data is captured and indexed in self.log_store"""
+        capture = self.get_euca_log_capture(name)
+        offset = capture.size
+        capture.write(data)
+        self.log_store.ingest(name, offset, data)
+    
+    def grep_euca_log(self, component=None, regex=None):
+        """ Returns the captured euca log lines matching regex, from every log or only the logs of component (ie "nc00")
+            When regex is a resource id (ie an instance, volume or snapshot id) the matching lines are found in the 
+            log store's index and only those lines are read back, any other regex is searched for line by line
+            For example:
+            print "\n".join(tester.grep_euca_log(component="nc00", regex=instance.id))
+            regex is required, it is only a keyword argument so that component can come first
+        """
+        if regex is None:
+            raise Exception("grep_euca_log needs a regex (or resource id) to search the captured logs for")
+        lines = []
+        if self.log_store.is_resource_id(regex):
+            for name, offset, length in self.log_store.lookup(regex, component=component):
+                lines.append("".join(self.log_captures[name].read(offset, offset + length)).rstrip("\n"))
+            return lines
+        if component is None:
+            names = sorted(self.log_captures.keys())
+        else:
+            names = self.log_store.get_names(component)
+        expr = re.compile(regex)
+        for name in names:
+            if name in self.log_captures:
+                for line in self.log_captures[name].readlines():
+                    if expr.search(line):
+                        lines.append(line.rstrip("\n"))
+        return lines
+    
+    def get_euca_log_files(self, machines=None):
+        """ Returns a list of (machine, path, name) for each distinct log collected from machines, defaults to every reachable machine in the topology"""
+        if machines is None:
+            machines = [log_machine for log_machine in self.topology.machines if log_machine not in self.unreachable_machines]
+        files = []
+        for log_machine in machines:
+            for path in sorted(set(self.get_euca_log_paths(log_machine).values())):
+                files.append((log_machine, path, self.get_euca_log_name(log_machine, path)))
+        return files
+    
+    def stat_euca_logs(self, machines=None):
+        """ Returns a dictionary of log name => {"hostname", "path", "inode", "size", "time"} for every log collected from machines
+            Each host's logs are checked with a single stat command, hosts are checked concurrently
+        """
+        by_machine = {}
+        for log_machine, path, name in self.get_euca_log_files(machines):
+            by_machine.setdefault(log_machine, []).append((path, name))
+        def stat_machine(item):
+            log_machine, logs = item
+            stats = {}
+            try:
+                result = log_machine.ssh.cmd_raw("stat -c '%i %s %n' " + " ".join([path for path, name in logs]), verbose=False)
+            except Exception, e:
+                self.critical("Unable to stat logs on " + log_machine.hostname + ": " + str(e))
+                return stats
+            found = {}
+            for line in result["stdout"].splitlines():
+                fields = line.split(" ", 2)
+                if len(fields) == 3:
+                    found[fields[2]] = (int(fields[0]), int(fields[1]))
+            for path, name in logs:
+                if path in found:
+                    stats[name] = {"hostname": log_machine.hostname, "path": path, "inode": found[path][0], "size": found[path][1], "time": time.time()}
+            return stats
+        stats = {}
+        if len(by_machine) > 0:
+            pool = ThreadPool(min(self.bootstrap_workers, len(by_machine)))
+            try:
+                for machine_stats in pool.map(stat_machine, by_machine.items()):
+                    stats.update(machine_stats)
+            finally:
+                pool.close()
+                pool.join()
+        return stats
+    
+    def mark_euca_logs(self, phase, machines=None):
+        """ Record the current inode and size of every collected log as the boundary phase (ie "test_attach_volume-start")
+            The logs written between two marks can then be fetched with get_euca_log_slice(), no tailing thread is needed
+        """
+        self.euca_log_marks[phase] = self.stat_euca_logs(machines)
+        return self.euca_log_marks[phase]
+    
+    def get_euca_log_slice_cmd(self, start, end):
+        """ Returns the command which writes, gzipped, the bytes of a log between the marks start and end
+            The files are found by the inodes recorded in the marks, so a slice can still be fetched after the log has been rotated
+            If the log was rotated between the marks the rest of the rotated file comes first, then the new file up to the end mark
+            If it was truncated in place the file up to the end mark is returned
+        """
+        logdir = os.path.dirname(start["path"])
+        def find_inode(inode):
+            return "$(find " + logdir + " -maxdepth 1 -inum " + str(inode) + " 2>/dev/null | head -n 1)"
+        cmd = "start=" + find_inode(start["inode"]) + "; end=" + find_inode(end["inode"]) + "; "
+        if end["inode"] == start["inode"]:
+            if end["size"] >= start["size"]:
+                cmd += "[ -n \"$start\" ] && tail -c +" + str(start["size"] + 1) + " \"$start\" | head -c " + str(end["size"] - start["size"])
+            else:
+                cmd += "[ -n \"$end\" ] && head -c " + str(end["size"]) + " \"$end\""
         else:
-            client.connect(hostname,  username=username, key_filename=keypath)
-        return client
+            cmd += "{ [ -n \"$start\" ] && tail -c +" + str(start["size"] + 1) + " \"$start\"; [ -n \"$end\" ] && head -c " + str(end["size"]) + " \"$end\"; }"
+        return "( " + cmd + " ) | gzip -c"
+    
+    def get_euca_log_slice(self, start_phase, end_phase=None, component=None):
+        """ Returns a dictionary of log name => the data written to that log between the marks start_phase and end_phase
+            end_phase  defaults to now, the logs are stat'd again
+            component  only fetch the logs of component, ie "nc00"
+            Only the bytes of the slice are transferred, gzipped on the remote host
+            A log that can not be fetched (ie its host is unreachable) is reported with critical and left out of the result
+            For example:
+            tester.mark_euca_logs("attach-start")
+            volume.attach(instance.id, "/dev/sdj")
+            tester.mark_euca_logs("attach-end")
+            print tester.get_euca_log_slice("attach-start", "attach-end", component="sc00")
+        """
+        start_marks = self.euca_log_marks[start_phase]
+        if end_phase is None:
+            end_marks = self.stat_euca_logs()
+        else:
+            end_marks = self.euca_log_marks[end_phase]
+        names = [name for name in start_marks if name in end_marks]
+        if component is not None:
+            component_logs = self.get_component_euca_logs(component)
+            names = [name for name in names if name in component_logs]
+        def fetch_slice(name):
+            start = start_marks[name]
+            try:
+                log_machine = self.topology.by_host[start["hostname"]]
+                result = log_machine.ssh.cmd_raw(self.get_euca_log_slice_cmd(start, end_marks[name]), verbose=False)
+                if not result["stdout"]:
+                    return name, ""
+                return name, zlib.decompress(result["stdout"], 16 + zlib.MAX_WBITS)
+            except Exception, e:
+                self.critical("Unable to fetch the slice of " + name + " from " + start["hostname"] + ": " + str(e))
+                return name, None
+        if len(names) == 0:
+            return {}
+        pool = ThreadPool(min(self.bootstrap_workers, len(names)))
+        try:
+            return dict([(name, data) for name, data in pool.map(fetch_slice, names) if data is not None])
+        finally:
+            pool.close()
+            pool.join()
+    
+    @property
+    def cloud_log_buffer(self):
+        return self.get_euca_log_tail("cloud")
+    
+    @property
+    def walrus_log_buffer(self):
+        return self.get_euca_log_tail("walrus")
+    
+    @property
+    def cc_log_buffer(self):
+        return self.get_euca_log_tail("cc")
+    
+    @property
+    def sc_log_buffer(self):
+        return self.get_euca_log_tail("sc")
     
-    def poll_euca_logs(self):
+    @property
+    def nc_log_buffer(self):
+        return self.get_euca_log_tail("nc")
+    
+    def poll_euca_logs(self, logs=None, machines=None, log_tailer=None):
+        """ Tail eucalyptus logs until stop_euca_logs() is called, blocks until then (see start_euca_logs)
+            By default the log of every component on every machine in the topology is collected (see get_euca_log_paths), 
+            each host's logs are followed by a single tail on one channel and captured per host and file, ie "192.168.1.10-nc"
+            machines  list of machines to collect logs from instead of the whole topology
+            logs      list of (name, host, path) to tail instead, host being a component (ie "nc01") or a hostname
+            The data for each log is captured to disk under self.euca_log_dir as it arrives, 
+            the most recent part is available from get_euca_log_tail(name)
+            log_tailer  LogTailer to run, one is made (and set as self.log_tailer) if not given
+            Every log is read by one LogTailer which waits on all of them at once and wakes as soon as any has data
+        """
         self.debug( "Starting to poll Eucalyptus Logs")
-        ## START CLOUD Log
-        cloud_ssh =  self.create_ssh("clc", password=self.password)          
-        self.cloud_log_channel = cloud_ssh.invoke_shell()
-        self.cloud_log_channel.send("tail -f "  + self.eucapath + "/var/log/eucalyptus/cloud-output.log \n")
-        ### START WALRUS Log    
-        walrus_ssh =  self.create_ssh("ws", password=self.password)
-        self.walrus_log_channel = walrus_ssh.invoke_shell()
-        self.walrus_log_channel.send("tail -f "  + self.eucapath + "/var/log/eucalyptus/cloud-output.log \n")
-        ## START CC Log
-        cluster_ssh =  self.create_ssh("cc00", password=self.password)
-        self.cc_log_channel = cluster_ssh.invoke_shell()
-        self.cc_log_channel.send("tail -f "  + self.eucapath + "/var/log/eucalyptus/cc.log \n")
-        ## START SC Log
-        storage_ssh =  self.create_ssh("sc00", password=self.password)
-        self.sc_log_channel = storage_ssh.invoke_shell()
-        self.sc_log_channel.send("tail -f "  + self.eucapath + "/var/log/eucalyptus/cloud-output.log \n")
-        ## START NC LOG
-        nc_ssh =  self.create_ssh("nc00", password=self.password)
-        self.nc_log_channel = nc_ssh.invoke_shell()
-        self.nc_log_channel.send("tail -f "  + self.eucapath + "/var/log/eucalyptus/nc.log \n")
-        self.logging_thread = True
-        
-        ### Begin polling channel for any new data
-        while self.logging_thread:
-            ### CLOUD LOG
-            rl, wl, xl = select.select([self.cloud_log_channel],[],[],0.0)
-            if len(rl) > 0:
-                self.cloud_log_buffer += self.cloud_log_channel.recv(1024)
-            ### CC LOG
-            rl, wl, xl = select.select([self.cc_log_channel],[],[],0.0)
-            if len(rl) > 0:
-                self.cc_log_buffer += self.cc_log_channel.recv(1024)
-            ### SC LOG
-            rl, wl, xl = select.select([self.sc_log_channel],[],[],0.0)
-            if len(rl) > 0:
-                self.sc_log_buffer += self.sc_log_channel.recv(1024)
-            ### WALRUS LOG
-            rl, wl, xl = select.select([self.walrus_log_channel],[],[],0.0)
-            if len(rl) > 0:
-                self.walrus_log_buffer += self.walrus_log_channel.recv(1024)
-            ### NC LOG
-            rl, wl, xl = select.select([self.nc_log_channel],[],[],0.0)
-            if len(rl) > 0:
-                self.nc_log_buffer += self.nc_log_channel.recv(1024)
-            self.sleep(1)
+        if log_tailer is None:
+            log_tailer = LogTailer(self.capture_euca_log, debugmethod=self.debug, verbose=True)
+            self.log_tailer = log_tailer
+            self.logging_thread = True
+        if logs is not None:
+            for name, host, path in logs:
+                if host in self.topology.by_host:
+                    log_machine = self.topology.by_host[host]
+                else:
+                    log_machine = self.get_component_machines(host)[0]
+                if host in log_machine.components:
+                    self.log_store.set_components(name, [host])
+                else:
+                    self.log_store.set_components(name, log_machine.components)
+                log_tailer.add_file(name, log_machine.ssh, path)
+        else:
+            if machines is None:
+                machines = [log_machine for log_machine in self.topology.machines if log_machine not in self.unreachable_machines]
+            def tail_machine(log_machine):
+                names = {}
+                components = {}
+                for component, path in self.get_euca_log_paths(log_machine).iteritems():
+                    names[path] = self.get_euca_log_name(log_machine, path)
+                    components.setdefault(names[path], []).append(component)
+                for name in components:
+                    self.log_store.set_components(name, components[name])
+                try:
+                    log_tailer.add_files(log_machine.ssh, names)
+                except Exception, e:
+                    self.critical("Unable to tail logs on " + log_machine.hostname + ": " + str(e))
+            ### Opening the channels may mean connecting to each host, do that concurrently
+            if len(machines) > 0:
+                pool = ThreadPool(min(self.bootstrap_workers, len(machines)))
+                try:
+                    pool.map(tail_machine, machines)
+                finally:
+                    pool.close()
+                    pool.join()
+        log_tailer.run()
             
-    def start_euca_logs(self):
-        '''Start thread to poll logs''' 
-        thread = threading.Thread(target=self.poll_euca_logs, args=())
+    def start_euca_logs(self, logs=None, machines=None):
+        '''Start thread to poll logs, the LogTailer is made here so stop_euca_logs() always finds it''' 
+        self.log_tailer = LogTailer(self.capture_euca_log, debugmethod=self.debug, verbose=True)
+        self.logging_thread = True
+        thread = threading.Thread(target=self.poll_euca_logs, args=(logs, machines, self.log_tailer))
         thread.daemon = True
-        self.logging_thread_pool.append(thread.start())
+        thread.start()
+        self.logging_thread_pool.append(thread)
         
-    def stop_euca_logs(self):
-        '''Terminate thread that is polling logs''' 
+    def stop_euca_logs(self, timeout=10):
+        '''Terminate thread that is polling logs, waits up to timeout seconds for it and then closes the captured logs' files''' 
         self.logging_thread = False
+        if self.log_tailer is not None:
+            self.log_tailer.stop()
+        for thread in self.logging_thread_pool:
+            if thread is not threading.current_thread():
+                thread.join(timeout)
+        self.logging_thread_pool = [thread for thread in self.logging_thread_pool if thread.is_alive()]
+        ### The data stays on disk and readable, a later start_euca_logs() carries on in a new segment file
+        for capture in self.log_captures.values():
+            capture.close()
         
-    def save_euca_logs(self,prefix="eutester-"):
-        '''Save log buffers to a file''' 
-        FILE = open( prefix + "clc.log","w")
-        FILE.writelines(self.cloud_log_buffer)
-        FILE.close()
-        FILE = open( prefix + "walrus.log","w")
-        FILE.writelines(self.walrus_log_buffer)
-        FILE.close()
-        FILE = open( prefix + "cc.log","w")
-        FILE.writelines(self.cc_log_buffer)
-        FILE.close()
-        FILE = open( prefix + "sc.log","w")
-        FILE.writelines(self.sc_log_buffer)
-        FILE.close()
-        FILE = open( prefix + "nc.log","w")
-        FILE.writelines(self.nc_log_buffer)
-        FILE.close()        
+    def save_euca_logs(self,prefix="eutester-", segment=None):
+        '''Append what each captured log gained since the last save to a gzip archive named prefix + name + ".log.gz"
+           Each save adds one gzip member per log, recorded with its offset and time range in prefix + "manifest.json",
+           so calling this at the end of every test with segment set to the test name makes each test's logs retrievable 
+           on their own with get_euca_log_archive(prefix).read(segment, name). zcat on an archive returns the whole log.
+           The data is streamed from the on disk captures through the compressor, it is never held in memory as a whole''' 
+        if segment is None:
+            segment = "segment-" + time.strftime("%Y%m%d-%H%M%S")
+        archive = self.get_euca_log_archive(prefix)
+        for name, capture in self.log_captures.items():
+            start, start_time = self.euca_log_saved.get((prefix, name), (0, capture.created))
+            end = capture.size
+            end_time = time.time()
+            archive.add(segment, name, capture.read(start, end), start_time, end_time)
+            self.euca_log_saved[(prefix, name)] = (end, end_time)
+        return archive
+    
+    def get_euca_log_archive(self, prefix="eutester-"):
+        '''Returns the LogArchive saved to by save_euca_logs(prefix)''' 
+        if prefix not in self.log_archives:
+            self.log_archives[prefix] = LogArchive(prefix)
+        return self.log_archives[prefix]
                                
     def handle_timeout(self, signum, frame): 
         raise TimeoutFunctionException()
@@ -470,13 +857,100 @@ class Eutester(object):
         """
         return self.clc.sys(cmd, verbose=verbose)
 
+    def fanout_sys(self, cmd, component=None, machines=None, workers=10, timeout=120, verbose=False, multiplex=False):
+        """ Run a command on many machines at once using a bounded pool of worker threads, returns a dictionary of results keyed by hostname
+            cmd        command to run on every machine, or a dictionary of hostname => command to run a different command per host
+            component  component used to pick machines with get_component_machines(), ie "nc00". Defaults to every machine in the config
+            machines   list of machine objects to run against instead of looking them up by component
+            workers    maximum number of hosts to run the command on at the same time
+            timeout    per host command timeout in seconds
+            multiplex  run every command from this thread with an SshMultiplexer instead of the worker pool, for very large numbers of hosts
+            Each result is a dictionary with the keys: cmd, output (list of lines), status (exit code), elapsed (seconds) and error (None unless the command raised)
+            For example:
+            results = tester.fanout_sys("df -h /", component="nc00")
+            for hostname, result in results.iteritems():
+                print hostname, result["status"], result["elapsed"]
+        """
+        if machines is None:
+            if component is not None:
+                machines = self.get_component_machines(component)
+            elif isinstance(cmd, dict):
+                machines = [self.get_machine_by_ip(hostname) for hostname in cmd]
+            else:
+                machines = self.config['machines']
+        if len(machines) == 0:
+            return {}
+
+        def get_machine_cmd(machine):
+            if isinstance(cmd, dict):
+                return cmd[machine.hostname]
+            return cmd
+
+        def run_on_machine(machine):
+            machine_cmd = get_machine_cmd(machine)
+            start = time.time()
+            try:
+                result = machine.ssh.cmd(machine_cmd, verbose=verbose, timeout=timeout, listformat=True, get_status=True)
+                result['error'] = None
+            except Exception, e:
+                result = {'cmd':machine_cmd, 'output':[], 'status':None, 'elapsed':time.time() - start, 'error':str(e)}
+            return machine.hostname, result
+
+        start = time.time()
+        if multiplex:
+            mux = sshconnection.SshMultiplexer(debugmethod=self.debug, verbose=verbose)
+            for machine in machines:
+                mux.add(machine.ssh, get_machine_cmd(machine))
+            results = dict(zip([machine.hostname for machine in machines], mux.run(timeout=timeout)))
+        else:
+            pool = ThreadPool(min(workers, len(machines)))
+            try:
+                results = dict(pool.map(run_on_machine, machines))
+            finally:
+                pool.close()
+                pool.join()
+        self.debug("Ran fanout command on " + str(len(machines)) + " machines in " + str(round(time.time() - start, 2)) + " seconds")
+        for hostname, result in results.iteritems():
+            if result['error'] is not None:
+                self.critical("Fanout command failed on " + hostname + ": " + result['error'])
+        return results
+
+    def put_file(self, localpath, remotepath, component=None, machines=None, workers=10):
+        """ Upload a local file to many machines at once with chunked, resumable and md5 verified sftp transfers
+            Returns a dictionary of hostname => None for success or the error string for hosts that failed
+            localpath   path of the local file to upload
+            remotepath  path to write the file to on each machine
+            component   component used to pick machines with get_component_machines(), ie "nc00". Defaults to every machine in the config
+            machines    list of machine objects to upload to instead of looking them up by component
+            workers     maximum number of machines to upload to at the same time
+        """
+        if machines is None:
+            if component is not None:
+                machines = self.get_component_machines(component)
+            else:
+                machines = self.config['machines']
+        errors = sftptransfer.put_to_many([machine.ssh for machine in machines], localpath, remotepath, workers=workers, debugmethod=self.debug)
+        for hostname, error in errors.iteritems():
+            if error is not None:
+                self.critical("Failed to upload " + localpath + " to " + hostname + ": " + error)
+        return errors
+
+    def get_local_shell(self):
+        """ Returns the LocalShell used to run local commands, with the eucarc environment from credpath loaded if there is one"""
+        eucarc_path = None
+        if self.credpath is not None:
+            eucarc_path = os.path.join(self.credpath, "eucarc")
+        if (self.local_shell is None) or (self.local_shell.eucarc_path != eucarc_path):
+            self.local_shell = LocalShell(eucarc_path, debugmethod=self.debug, verbose=True)
+        return self.local_shell
+
     def local(self, cmd):
-        """ Run a command locally on the tester"""
-        for item in os.popen("ls").readlines():
-            if re.match(self.credpath,item):
-                cmd = ". " + self.credpath + "/eucarc && " + cmd
-        std_out_return = os.popen(cmd).readlines()
-        return std_out_return
+        """ Run a command locally on the tester, returns the lines of stdout, stderr and a non-zero exit status are logged with debug"""
+        return self.get_local_shell().sys(cmd)
+
+    def local_many(self, cmds, workers=10):
+        """ Run a list of commands locally at the same time, returns a list of result dictionaries with the keys cmd, status, stdout, stderr and elapsed"""
+        return self.get_local_shell().run_many(cmds, workers=workers)
     
     def found(self, command, regex, local=False):
         """ Returns a Boolean of whether the result of the command contains the regex"""
@@ -0,0 +1,89 @@
+'''
+Thread safe access to boto connections
+
+boto connection objects (and the http connections they keep alive underneath) must not be used by two threads at
+once. A BotoConnectionPool builds connections from a factory method and hands them out in one of two ways:
+    get()        - the calling thread's own connection, created the first time that thread asks for it
+    connection() - a context manager which checks a connection out of a bounded set of 'size' connections
+                   and returns it afterwards, blocking while all of them are in use (for worker pools / load generators)
+
+example usage:
+    import botopool
+    pool = botopool.BotoConnectionPool(lambda: boto.connect_ec2(...), size=10)
+    pool.get().get_all_instances()
+    with pool.connection() as ec2:
+        ec2.get_all_volumes()
+'''
+
+import threading
+import Queue
+from contextlib import contextmanager
+
+
+class BotoConnectionPool(object):
+
+    def __init__(self, factory, size=10):
+        '''
+        factory - mandatory - method taking no arguments which returns a new boto connection
+        size - optional - integer, maximum number of connections handed out through connection() at once
+        '''
+        self.factory = factory
+        self.size = size
+        self.local = threading.local()
+        self.idle = Queue.Queue()
+        self.created = 0
+        self.lock = threading.Lock()
+
+    def get(self):
+        '''
+        Returns the boto connection owned by the calling thread, creating it on first use
+        '''
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = self.factory()
+            self.local.connection = connection
+        return connection
+
+    def acquire(self, timeout=None):
+        '''
+        Check a connection out of the bounded pool, blocks (up to timeout seconds if given) while all 'size' connections are in use
+        Every acquire() must be paired with a release() of the same connection
+        '''
+        try:
+            return self.idle.get_nowait()
+        except Queue.Empty:
+            pass
+        with self.lock:
+            if self.created < self.size:
+                self.created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return self.factory()
+            except:
+                with self.lock:
+                    self.created -= 1
+                raise
+        try:
+            return self.idle.get(True, timeout)
+        except Queue.Empty:
+            raise Exception("Timed out waiting for one of " + str(self.size) + " pooled boto connections")
+
+    def release(self, connection):
+        '''
+        Return a connection checked out with acquire() to the pool
+        '''
+        self.idle.put(connection)
+
+    @contextmanager
+    def connection(self, timeout=None):
+        '''
+        Context manager which checks a connection out of the bounded pool for the duration of the with block
+        '''
+        connection = self.acquire(timeout)
+        try:
+            yield connection
+        finally:
+            self.release(connection)
@@ -0,0 +1,113 @@
+'''
+Local cache of cloud credentials so repeated test runs do not have to regenerate and download them from the CLC
+
+Entries are stored in a directory named by the sha1 of the cloud, account and user they belong to. Each entry holds
+the creds.zip returned by euca_conf plus a small manifest with the sha1 of that zip, so a truncated or modified
+entry is detected and ignored.
+
+example usage:
+    import credcache
+    cache = credcache.CredentialCache()
+    if not cache.restore("clc.mydomain.com", "eucalyptus", "admin", "eucarc-eucalyptus-admin"):
+        ### download credentials into eucarc-eucalyptus-admin then
+        cache.store("clc.mydomain.com", "eucalyptus", "admin", "eucarc-eucalyptus-admin")
+'''
+
+import os
+import time
+import shutil
+import hashlib
+import zipfile
+
+
+class CredentialCache(object):
+
+    def __init__(self, cachedir=None):
+        '''
+        cachedir - optional - string, directory entries are stored in, defaults to ~/.eutester/credentials
+        '''
+        if cachedir is None:
+            cachedir = os.path.join(os.path.expanduser("~"), ".eutester", "credentials")
+        self.cachedir = cachedir
+
+    def get_key(self, cloud, account, user):
+        '''
+        Returns the key an entry is stored under for the given cloud, account and user
+        '''
+        return hashlib.sha1("|".join([str(cloud), str(account), str(user)])).hexdigest()
+
+    def get_path(self, cloud, account, user):
+        '''
+        Returns the directory an entry is stored in for the given cloud, account and user
+        '''
+        return os.path.join(self.cachedir, self.get_key(cloud, account, user))
+
+    def get_digest(self, path):
+        '''
+        Returns the sha1 hex digest of the file at path
+        '''
+        sha1 = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024*1024), ""):
+                sha1.update(block)
+        return sha1.hexdigest()
+
+    def lookup(self, cloud, account, user):
+        '''
+        Returns the path of the cached creds.zip for the cloud, account and user or None if there is no valid entry
+        '''
+        entry = self.get_path(cloud, account, user)
+        zippath = os.path.join(entry, "creds.zip")
+        manifest = os.path.join(entry, "manifest")
+        if not (os.path.isfile(zippath) and os.path.isfile(manifest)):
+            return None
+        with open(manifest) as f:
+            fields = dict(line.strip().split("=", 1) for line in f if "=" in line)
+        if fields.get("sha1") != self.get_digest(zippath):
+            self.invalidate(cloud, account, user)
+            return None
+        return zippath
+
+    def store(self, cloud, account, user, credpath):
+        '''
+        Add the creds.zip found in credpath to the cache for the cloud, account and user
+        '''
+        entry = self.get_path(cloud, account, user)
+        if not os.path.isdir(entry):
+            os.makedirs(entry, 0700)
+        zippath = os.path.join(entry, "creds.zip")
+        shutil.copyfile(os.path.join(credpath, "creds.zip"), zippath)
+        with open(os.path.join(entry, "manifest"), "w") as f:
+            f.write("cloud=" + str(cloud) + "\n")
+            f.write("account=" + str(account) + "\n")
+            f.write("user=" + str(user) + "\n")
+            f.write("sha1=" + self.get_digest(zippath) + "\n")
+            f.write("stored=" + str(int(time.time())) + "\n")
+        return entry
+
+    def restore(self, cloud, account, user, credpath):
+        '''
+        Unpack the cached credentials for the cloud, account and user into credpath
+        Returns True if a valid entry was found and restored, otherwise False
+        '''
+        zippath = self.lookup(cloud, account, user)
+        if zippath is None:
+            return False
+        if os.path.isdir(credpath):
+            shutil.rmtree(credpath)
+        os.makedirs(credpath)
+        shutil.copyfile(zippath, os.path.join(credpath, "creds.zip"))
+        archive = zipfile.ZipFile(zippath)
+        try:
+            archive.extractall(credpath)
+        finally:
+            archive.close()
+        return True
+
+    def invalidate(self, cloud, account, user):
+        '''
+        Remove the cached entry for the cloud, account and user
+        '''
+        entry = self.get_path(cloud, account, user)
+        if os.path.isdir(entry):
+            shutil.rmtree(entry)
@@ -0,0 +1,116 @@
+'''
+In memory model of a eucarc credentials file
+
+The file is parsed once into a dictionary and only read again when its modification time changes.
+Service URLs are broken out into host, port, path and is_secure so connection setup does not need to re-parse them.
+
+example usage:
+    import eucarc
+    rc = eucarc.Eucarc("eucarc-eucalyptus-admin/eucarc")
+    print rc.access_key, rc.ec2_endpoint["host"], rc.ec2_endpoint["port"], rc.ec2_endpoint["path"]
+'''
+
+import os
+import urlparse
+
+
+class Eucarc(object):
+
+    def __init__(self, path):
+        '''
+        path - mandatory - string, path to the eucarc file
+        '''
+        self.path = path
+        self.values = {}
+        self.endpoints = {}
+        self.mtime = None
+        self.load()
+
+    def load(self):
+        '''
+        Parse the eucarc into self.values, lines of the form [export ]NAME=value with optional quotes around value
+        '''
+        mtime = os.stat(self.path).st_mtime
+        values = {}
+        with open(self.path) as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith("export "):
+                    line = line[len("export "):].strip()
+                if (not line) or line.startswith("#") or ("=" not in line):
+                    continue
+                name, value = line.split("=", 1)
+                values[name.strip()] = value.strip().strip("'").strip('"')
+        self.values = values
+        self.endpoints = {}
+        self.mtime = mtime
+
+    def refresh(self):
+        '''
+        Reload the eucarc if it has been modified since it was last parsed, returns True if it was reloaded
+        '''
+        if os.stat(self.path).st_mtime != self.mtime:
+            self.load()
+            return True
+        return False
+
+    def get(self, field, default=None):
+        '''
+        Returns the value of field from the eucarc, raises an exception if it is not present and no default is given
+        '''
+        self.refresh()
+        if field in self.values:
+            return self.values[field]
+        if default is not None:
+            return default
+        raise Exception("Unable to find " + field + " in eucarc " + self.path)
+
+    def get_endpoint(self, field, default=None):
+        '''
+        Returns the URL in field broken into a dictionary with the keys: url, host, port, path and is_secure
+        default - optional - URL used when field is not present in the eucarc
+        '''
+        url = self.get(field, default)
+        if url in self.endpoints:
+            return self.endpoints[url]
+        parsed = urlparse.urlparse(url)
+        is_secure = (parsed.scheme == "https")
+        port = parsed.port
+        if port is None:
+            port = 443 if is_secure else 80
+        endpoint = {"url": url,
+                    "host": parsed.hostname,
+                    "port": port,
+                    "path": parsed.path or "/",
+                    "is_secure": is_secure}
+        self.endpoints[url] = endpoint
+        return endpoint
+
+    @property
+    def access_key(self):
+        return self.get("EC2_ACCESS_KEY")
+
+    @property
+    def secret_key(self):
+        return self.get("EC2_SECRET_KEY")
+
+    @property
+    def account_id(self):
+        return self.get("EC2_ACCOUNT_NUMBER")
+
+    @property
+    def ec2_endpoint(self):
+        return self.get_endpoint("EC2_URL")
+
+    @property
+    def s3_endpoint(self):
+        return self.get_endpoint("S3_URL")
+
+    @property
+    def euare_endpoint(self):
+        '''
+        Older eucarcs do not define EUARE_URL, in that case Euare is assumed to live next to EC2 on the CLC
+        '''
+        ec2 = self.ec2_endpoint
+        default = ("https" if ec2["is_secure"] else "http") + "://" + ec2["host"] + ":" + str(ec2["port"]) + "/services/Euare"
+        return self.get_endpoint("EUARE_URL", default)
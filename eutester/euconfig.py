@@ -0,0 +1,208 @@
+'''
+Loading, validation and conversion of tester topology configs
+
+Two formats are understood:
+    legacy     - the whitespace separated 2b_tested.lst format, one machine per line:
+                     clc.mydomain.com CENTOS 5.7 64 REPO [CC00 CLC SC00 WS]
+                     nc1.mydomain.com VMWARE ESX-4.0 64 REPO [NC00]
+                     NETWORK MANAGED
+    structured - a JSON (or YAML, when PyYAML is installed) document which can also carry per host tuning:
+                     {
+                         "network": "managed",
+                         "defaults": {"distro": "CENTOS", "distro_ver": "5.7", "arch": "64", "source": "REPO"},
+                         "machines": [
+                             {"hostname": "clc.mydomain.com", "components": ["clc", "ws", "cc00", "sc00"],
+                              "ssh_port": 22, "keypath": "/root/.ssh/id_rsa", "max_sessions": 10},
+                             {"hostname": "nc1.mydomain.com", "components": ["nc00"], "distro": "VMWARE",
+                              "log_paths": {"nc00": "/var/log/eucalyptus/nc.log"}}
+                         ]
+                     }
+Values in "defaults" apply to every machine which does not set them itself. Configs are validated as a whole and
+every problem found is reported in a single exception.
+
+example usage:
+    import euconfig
+    config = euconfig.load_config("2b_tested.lst")
+    for host in config["machines"]:
+        print host["hostname"], host["components"], host["ssh_port"]
+    euconfig.convert_legacy_config("2b_tested.lst", "topology.json")
+'''
+
+import re
+import json
+import collections
+
+### field name => (allowed types, required, default)
+MACHINE_FIELDS = collections.OrderedDict([("hostname", ((basestring,), True, None)),
+                                          ("distro", ((basestring,), True, None)),
+                                          ("distro_ver", ((basestring, int, float), True, None)),
+                                          ("arch", ((basestring, int), True, None)),
+                                          ("source", ((basestring,), True, None)),
+                                          ("components", ((list,), True, None)),
+                                          ("username", ((basestring,), False, "root")),
+                                          ("password", ((basestring,), False, None)),
+                                          ("keypath", ((basestring,), False, None)),
+                                          ("ssh_port", ((int,), False, 22)),
+                                          ("max_sessions", ((int,), False, None)),
+                                          ("log_paths", ((dict,), False, None))])
+
+COMPONENT_RE = re.compile(r"^[a-z][a-z_]*\d*$")
+LEGACY_MACHINE_RE = re.compile(r".*\[.*]")
+LEGACY_NETWORK_RE = re.compile(r"network", re.IGNORECASE)
+
+
+def get_format(filepath, data):
+    '''
+    Returns "json", "yaml" or "legacy" for the config at filepath whose contents are data
+    '''
+    if filepath.endswith(".yaml") or filepath.endswith(".yml"):
+        return "yaml"
+    if filepath.endswith(".json") or data.lstrip().startswith("{"):
+        return "json"
+    return "legacy"
+
+
+def parse_legacy_config(data):
+    '''
+    Parse the legacy whitespace separated format, returns a config dictionary with the keys "network" and "machines"
+    '''
+    config = {"network": None, "machines": []}
+    for line in data.splitlines():
+        line = line.strip()
+        if LEGACY_MACHINE_RE.match(line):
+            machine_details = line.split(None, 5)
+            config["machines"].append({"hostname": machine_details[0],
+                                       "distro": machine_details[1],
+                                       "distro_ver": machine_details[2],
+                                       "arch": machine_details[3],
+                                       "source": machine_details[4],
+                                       "components": map(str.lower, machine_details[5].strip('[]').split())})
+        if LEGACY_NETWORK_RE.search(line):
+            config["network"] = line.split()[1].lower()
+    return config
+
+
+def validate_config(config):
+    '''
+    Check a structured config against MACHINE_FIELDS, returns the list of problems found (empty if it is valid)
+    '''
+    errors = []
+    if not isinstance(config, dict):
+        return ["config must be a dictionary with a 'machines' list"]
+    if not isinstance(config.get("machines"), list) or len(config["machines"]) == 0:
+        errors.append("config must contain a non empty 'machines' list")
+        return errors
+    if (config.get("network") is not None) and (not isinstance(config["network"], basestring)):
+        errors.append("network must be a string")
+    defaults = config.get("defaults") or {}
+    if not isinstance(defaults, dict):
+        errors.append("defaults must be a dictionary")
+        defaults = {}
+    for field in defaults:
+        if field not in MACHINE_FIELDS or field in ("hostname", "components"):
+            errors.append("defaults: unknown field " + field)
+    hostnames = {}
+    for index, host in enumerate(config["machines"]):
+        name = "machines[" + str(index) + "]"
+        if not isinstance(host, dict):
+            errors.append(name + " must be a dictionary")
+            continue
+        if isinstance(host.get("hostname"), basestring):
+            name = host["hostname"]
+            if name in hostnames:
+                errors.append(name + ": listed more than once")
+            hostnames[name] = True
+        for field in host:
+            if field not in MACHINE_FIELDS:
+                errors.append(name + ": unknown field " + field)
+        for field, (types, required, default) in MACHINE_FIELDS.iteritems():
+            value = host.get(field, defaults.get(field))
+            if value is None:
+                if required:
+                    errors.append(name + ": missing required field " + field)
+                continue
+            if (not isinstance(value, types)) or isinstance(value, bool):
+                errors.append(name + ": " + field + " has the wrong type " + type(value).__name__)
+                continue
+            if field == "components":
+                if len(value) == 0:
+                    errors.append(name + ": components must not be empty")
+                for component in value:
+                    if not (isinstance(component, basestring) and COMPONENT_RE.match(component.lower())):
+                        errors.append(name + ": invalid component name " + str(component))
+            elif field == "ssh_port" and not (0 < value < 65536):
+                errors.append(name + ": ssh_port " + str(value) + " is out of range")
+            elif field == "max_sessions" and value < 1:
+                errors.append(name + ": max_sessions must be at least 1")
+            elif field == "log_paths":
+                for component, path in value.iteritems():
+                    if not isinstance(path, basestring):
+                        errors.append(name + ": log_paths[" + str(component) + "] must be a string")
+    return errors
+
+
+def normalize_config(config):
+    '''
+    Returns a copy of a valid structured config where every machine has every field of MACHINE_FIELDS set,
+    taken from the machine itself, then "defaults", then the built in default
+    '''
+    defaults = config.get("defaults") or {}
+    machines = []
+    for host in config["machines"]:
+        machine_dict = {}
+        for field, (types, required, default) in MACHINE_FIELDS.iteritems():
+            machine_dict[field] = host.get(field, defaults.get(field, default))
+        machine_dict["distro_ver"] = str(machine_dict["distro_ver"])
+        machine_dict["arch"] = str(machine_dict["arch"])
+        machine_dict["components"] = [component.lower() for component in machine_dict["components"]]
+        machines.append(machine_dict)
+    network = config.get("network")
+    if network is not None:
+        network = network.lower()
+    return {"network": network, "machines": machines}
+
+
+def load_config(filepath):
+    '''
+    Load and validate the config at filepath in either the legacy or structured format
+    Returns a dictionary with the keys "network" and "machines", a list of one dictionary per machine holding every field of MACHINE_FIELDS
+    Raises an exception listing every problem found if the config is not valid
+    '''
+    with open(filepath) as f:
+        data = f.read()
+    config_format = get_format(filepath, data)
+    if config_format == "legacy":
+        config = parse_legacy_config(data)
+    elif config_format == "yaml":
+        try:
+            import yaml
+        except ImportError:
+            raise Exception("PyYAML is required to read the config " + filepath)
+        config = yaml.safe_load(data)
+    else:
+        config = json.loads(data)
+    errors = validate_config(config)
+    if errors:
+        raise Exception("Invalid config " + filepath + ":\n    " + "\n    ".join(errors))
+    return normalize_config(config)
+
+
+def convert_legacy_config(legacy_path, output_path=None):
+    '''
+    Convert a legacy config into the structured JSON format
+    legacy_path - mandatory - string, path of the legacy config
+    output_path - optional - string, path the JSON config is written to
+    Returns the structured config dictionary
+    '''
+    with open(legacy_path) as f:
+        config = parse_legacy_config(f.read())
+    errors = validate_config(config)
+    if errors:
+        raise Exception("Invalid config " + legacy_path + ":\n    " + "\n    ".join(errors))
+    if config["network"] is None:
+        del config["network"]
+    if output_path is not None:
+        with open(output_path, "w") as f:
+            json.dump(config, f, indent=4, sort_keys=True)
+            f.write("\n")
+    return config
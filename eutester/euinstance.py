@@ -55,6 +55,7 @@ class EuInstance(Instance):
         debugmethod - optional - method, used for debug output 
         verbose - optional - boolean to determine if debug is to be printed using debug()
         retry - optional - integer, ssh connection attempts for non-authentication failures
+        The ssh session to the instance is not established until it is first used
         '''
         newins = EuInstance(instance.connection)
         newins.__dict__ = instance.__dict__
@@ -85,7 +86,8 @@ class EuInstance(Instance):
                                                     timeout=timeout, 
                                                     retry=retry,
                                                     debugmethod=newins.debugmethod,
-                                                    verbose=True)
+                                                    verbose=True,
+                                                    lazy=True)
     
         
 
@@ -102,7 +104,8 @@ class EuInstance(Instance):
                                                     timeout=self.timeout, 
                                                     retry=self.retry,
                                                     debugmethod=self.debugmethod,
-                                                    verbose=True)
+                                                    verbose=True,
+                                                    lazy=True)
     def debug(self,msg):
         '''
         Used to print debug, defaults to print() but over ridden by self.debugmethod if not None
@@ -112,21 +115,59 @@ class EuInstance(Instance):
                 self.debugmethod(msg)
 
                 
-    def sys(self, cmd, verbose=True, timeout=120):
+    def sys(self, cmd, verbose=True, timeout=120, cb=None, tail=None):
         '''
         Issues a command against the ssh connection to this instance
         Returns a list of the lines from stdout+stderr as a result of the command
         cmd - mandatory - string, the command to be executed 
         verbose - optional - boolean flag to enable debug
         timeout - optional - command timeout in seconds 
+        cb - optional - method called with each line of output as it arrives
+        tail - optional - integer, only keep and return the last 'tail' lines of output
         '''
         output = []
         if (self.ssh is not None):
-            output = self.ssh.sys(cmd, verbose=verbose, timeout=timeout)
+            output = self.ssh.sys(cmd, verbose=verbose, timeout=timeout, cb=cb, tail=tail)
             return output
         else:
             raise Exception("Euinstance ssh connection is None")
     
+    def stream(self, cmd, verbose=True, timeout=120):
+        '''
+        Generator which issues a command against the ssh connection to this instance and yields each line of output as it arrives
+        cmd - mandatory - string, the command to be executed 
+        verbose - optional - boolean flag to enable debug
+        timeout - optional - command timeout in seconds 
+        '''
+        if (self.ssh is None):
+            raise Exception("Euinstance ssh connection is None")
+        return self.ssh.stream(cmd, verbose=verbose, timeout=timeout)
+    
+    def sys_raw(self, cmd, verbose=True, timeout=120, stdin=None):
+        '''
+        Issues a command against the ssh connection to this instance without a pty
+        Returns a dictionary with the keys 'cmd', 'status' (exit code), 'stdout', 'stderr' and 'elapsed', output is returned byte for byte
+        cmd - mandatory - string, the command to be executed 
+        verbose - optional - boolean flag to enable debug
+        timeout - optional - command timeout in seconds 
+        stdin - optional - string, data written to the command's stdin
+        '''
+        if (self.ssh is None):
+            raise Exception("Euinstance ssh connection is None")
+        return self.ssh.cmd_raw(cmd, verbose=verbose, timeout=timeout, stdin=stdin)
+    
+    def sys_batch(self, cmds, verbose=True, timeout=120):
+        '''
+        Issues a list of commands against the ssh connection to this instance in a single round trip
+        Returns a list of dictionaries with the keys 'cmd', 'output' and 'status', one per command in order
+        cmds - mandatory - list of strings, the commands to be executed 
+        verbose - optional - boolean flag to enable debug
+        timeout - optional - timeout in seconds for the whole batch
+        '''
+        if (self.ssh is None):
+            raise Exception("Euinstance ssh connection is None")
+        return self.ssh.sys_batch(cmds, verbose=verbose, timeout=timeout)
+    
     def found(self, command, regex):
         """ Returns a Boolean of whether the result of the command contains the regex"""
         result = self.sys(command)
@@ -144,7 +185,7 @@ class EuInstance(Instance):
         Method to check for the presence of a file at 'filepath' on the instance
         filepath - mandatory - string, the filepath to verify
         '''
-        if not self.found("stat "+filepath+" &> /dev/null && echo 'good'", 'good'):
+        if self.sys_raw("stat "+filepath, verbose=False)['status'] != 0:
             raise Exception("File:"+filepath+" not found on instance:"+self.id)
             return False
         self.debug('File '+filepath+' is present on '+self.id)
@@ -170,8 +211,10 @@ class EuInstance(Instance):
         self.assertFilePresent(voldev)
         self.assertFilePresent(srcdev)
         self.sys("dd if="+srcdev+" of="+voldev+" && sync")
-        md5 = self.sys("md5sum "+voldev, timeout=timeout)[0]
-        md5 = md5.split(' ')[0]
+        result = self.sys_raw("md5sum "+voldev, timeout=timeout)
+        if result['status'] != 0:
+            raise Exception("md5sum of "+voldev+" failed on instance:"+self.id+" stderr:"+result['stderr'])
+        md5 = result['stdout'].split(' ')[0]
         self.debug("Filled Volume:"+volume.id+" dev:"+voldev+" md5:"+md5)
         return md5
         
@@ -25,8 +25,6 @@ Sample:
     
 
 '''
-from eucaops import Eucaops
-from eutester import Eutester
 
 
 
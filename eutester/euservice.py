@@ -141,9 +141,14 @@ class EuserviceManager(object):
         if self.tester.clc is None:
             raise AttributeError("Tester object does not have CLC machine to use for SSH")
         self.update()
-        for clc in self.clcs: 
-            clc.machine.sftp.put( self.tester.credpath + "/creds.zip" , self.tester.credpath + "/creds.zip")
-            clc.machine.sys("unzip -o " +  self.tester.credpath  + "/creds.zip -d " + self.tester.credpath )
+        clc_machines = [clc.machine for clc in self.clcs]
+        ### Credentials may have come from the local cache so make sure the directory exists on every CLC
+        self.tester.fanout_sys("mkdir -p " + self.tester.credpath, machines=clc_machines)
+        errors = self.tester.put_file( self.tester.credpath + "/creds.zip" , self.tester.credpath + "/creds.zip", machines=clc_machines)
+        for hostname, error in errors.iteritems():
+            if error is not None:
+                raise IOError("Unable to copy credentials to " + hostname + ": " + error)
+        self.tester.fanout_sys("unzip -o " +  self.tester.credpath  + "/creds.zip -d " + self.tester.credpath, machines=clc_machines)
     
     def get(self, name=""):
         try:
@@ -0,0 +1,288 @@
+#!/usr/bin/python
+'''
+Long lived tester session shared by short test scripts over a local unix socket
+
+Building a tester parses the config, connects to every machine, downloads credentials and sets up boto. The session
+daemon does that once and keeps the tester (with its ssh pool, credentials and boto connections) warm, scripts then
+attach to it and run commands and API calls through it in milliseconds.
+
+The protocol is one JSON document per line in each direction. A request names a call and its arguments:
+    {"id": 1, "call": "fanout_sys", "args": ["uptime"], "kwargs": {"component": "nc00"}}
+and is answered with either its result or an error:
+    {"id": 1, "result": {...}}
+    {"id": 1, "error": "Could not find component nc00 in list of machines"}
+Calls are:
+    ping                                    - returns the daemon's pid, uptime and number of requests served
+    sys(cmd, host=None, component=None)     - run cmd on a machine (the CLC by default), returns the lines of output
+    fanout_sys(cmd, component=None, ...)    - Eutester.fanout_sys(), returns the results keyed by hostname
+    api(service, method, *args, **kwargs)   - call method on a connection checked out of the tester's "ec2", "walrus" or "euare" boto pool
+    tester(method, *args, **kwargs)         - call a public method of the tester
+    shutdown                                - stop the daemon
+Objects that are not plain JSON types (ie boto instances) are returned as a dictionary of their public attributes.
+
+example usage:
+    ./eusessiond.py --config 2b_tested.lst --password foobar &
+
+    import eusessiond
+    session = eusessiond.attach()
+    print session.sys("uptime", component="clc")
+    for reservation in session.api("ec2", "get_all_instances"):
+        print reservation["id"]
+'''
+
+import os
+import sys
+import json
+import time
+import errno
+import socket
+import threading
+import SocketServer
+
+
+def get_default_socket_path():
+    '''
+    Returns the socket path used when none is given, $EUTESTER_SESSION or ~/.eutester/session.sock
+    '''
+    if os.environ.get("EUTESTER_SESSION"):
+        return os.environ["EUTESTER_SESSION"]
+    return os.path.join(os.path.expanduser("~"), ".eutester", "session.sock")
+
+
+def serialize(value, depth=0):
+    '''
+    Returns value converted to plain JSON types, objects become a dictionary of their public attributes
+    '''
+    if (value is None) or isinstance(value, (bool, int, long, float, basestring)):
+        return value
+    if depth > 4:
+        return str(value)
+    if isinstance(value, dict):
+        return dict((str(key), serialize(item, depth + 1)) for key, item in value.iteritems())
+    if isinstance(value, (list, tuple, set)):
+        return [serialize(item, depth + 1) for item in value]
+    if hasattr(value, "__dict__"):
+        result = {"__class__": value.__class__.__name__}
+        for name, attr in vars(value).iteritems():
+            if name.startswith("_") or (name == "connection") or callable(attr):
+                continue
+            result[name] = serialize(attr, depth + 1)
+        return result
+    return str(value)
+
+
+class SessionHandler(SocketServer.StreamRequestHandler):
+    '''
+    Serves the requests of one attached client, one JSON request per line
+    '''
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            response = self.server.dispatch(line)
+            self.wfile.write(json.dumps(response) + "\n")
+            self.wfile.flush()
+            if self.server.stopping:
+                break
+
+
+class SessionServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    '''
+    Unix socket server which answers requests from attached clients with a single shared tester
+    Each client connection is served by its own thread, the tester's ssh and boto pools are safe to share between them
+    '''
+    daemon_threads = True
+
+    def __init__(self, tester, socket_path=None):
+        '''
+        tester - mandatory - Eutester (or Eucaops) object requests are run against
+        socket_path - optional - string, path of the unix socket to listen on, see get_default_socket_path()
+        '''
+        if socket_path is None:
+            socket_path = get_default_socket_path()
+        self.tester = tester
+        self.socket_path = socket_path
+        self.started = time.time()
+        self.requests = 0
+        self.stopping = False
+        self.lock = threading.Lock()
+        self.remove_stale_socket()
+        socket_dir = os.path.dirname(os.path.abspath(socket_path))
+        if not os.path.isdir(socket_dir):
+            os.makedirs(socket_dir, 0700)
+        ### Anyone who can connect can run commands as root on every host, so the socket must never exist with looser permissions
+        umask = os.umask(0177)
+        try:
+            SocketServer.UnixStreamServer.__init__(self, socket_path, SessionHandler)
+        finally:
+            os.umask(umask)
+        os.chmod(socket_path, 0600)
+
+    def remove_stale_socket(self):
+        '''
+        Remove a socket left behind by a daemon which is no longer running, raises an exception if one is still listening
+        '''
+        if not os.path.exists(self.socket_path):
+            return
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+        except socket.error:
+            os.unlink(self.socket_path)
+            return
+        finally:
+            sock.close()
+        raise Exception("A tester session is already listening on " + self.socket_path)
+
+    def dispatch(self, line):
+        '''
+        Run the request in line and return the response dictionary
+        '''
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            call = request["call"]
+            args = request.get("args", [])
+            kwargs = dict((str(key), value) for key, value in request.get("kwargs", {}).iteritems())
+            method = getattr(self, "call_" + str(call), None)
+            if method is None:
+                raise Exception("Unknown call " + str(call))
+            with self.lock:
+                self.requests += 1
+            return {"id": request_id, "result": serialize(method(*args, **kwargs))}
+        except Exception, e:
+            return {"id": request_id, "error": str(e)}
+
+    def call_ping(self):
+        return {"pid": os.getpid(), "uptime": time.time() - self.started, "requests": self.requests}
+
+    def call_sys(self, cmd, host=None, component=None, timeout=120):
+        if host is not None:
+            machine = self.tester.get_machine_by_ip(host)
+        elif component is not None:
+            machine = self.tester.get_component_machines(component)[0]
+        else:
+            machine = self.tester.clc
+        return machine.sys(cmd, verbose=False, timeout=timeout)
+
+    def call_fanout_sys(self, cmd, component=None, workers=10, timeout=120, multiplex=False):
+        return self.tester.fanout_sys(cmd, component=component, workers=workers, timeout=timeout, multiplex=multiplex)
+
+    def call_api(self, service, method, *args, **kwargs):
+        if method.startswith("_"):
+            raise Exception("Not allowed to call private method " + method)
+        with self.tester.get_boto_pool(service).connection() as connection:
+            return getattr(connection, method)(*args, **kwargs)
+
+    def call_tester(self, method, *args, **kwargs):
+        if method.startswith("_"):
+            raise Exception("Not allowed to call private method " + method)
+        return getattr(self.tester, method)(*args, **kwargs)
+
+    def call_shutdown(self):
+        self.stopping = True
+        threading.Thread(target=self.shutdown).start()
+        return True
+
+    def serve(self):
+        '''
+        Serve requests until a client sends shutdown, the socket is removed afterwards
+        '''
+        try:
+            self.serve_forever()
+        finally:
+            self.server_close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+
+class SessionClient(object):
+    '''
+    Connection from a script to a running tester session, safe to share between threads
+    '''
+
+    def __init__(self, socket_path=None, timeout=None):
+        '''
+        socket_path - optional - string, path of the session's unix socket, see get_default_socket_path()
+        timeout - optional - integer, seconds to wait for any one response, waits forever by default
+        '''
+        if socket_path is None:
+            socket_path = get_default_socket_path()
+        self.socket_path = socket_path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(socket_path)
+        self.rfile = self.sock.makefile("rb")
+        self.lock = threading.Lock()
+        self.next_id = 0
+
+    def call(self, call, *args, **kwargs):
+        '''
+        Send a request for call to the session and return its result, raises an exception with the session's error if it failed
+        '''
+        with self.lock:
+            self.next_id += 1
+            self.sock.sendall(json.dumps({"id": self.next_id, "call": call, "args": args, "kwargs": kwargs}) + "\n")
+            line = self.rfile.readline()
+        if not line:
+            raise IOError("Tester session at " + self.socket_path + " closed the connection")
+        response = json.loads(line)
+        if "error" in response:
+            raise Exception("Tester session error: " + response["error"])
+        return response["result"]
+
+    def ping(self):
+        return self.call("ping")
+
+    def sys(self, cmd, host=None, component=None, timeout=120):
+        return self.call("sys", cmd, host=host, component=component, timeout=timeout)
+
+    def fanout_sys(self, cmd, component=None, workers=10, timeout=120, multiplex=False):
+        return self.call("fanout_sys", cmd, component=component, workers=workers, timeout=timeout, multiplex=multiplex)
+
+    def api(self, service, method, *args, **kwargs):
+        return self.call("api", service, method, *args, **kwargs)
+
+    def tester(self, method, *args, **kwargs):
+        return self.call("tester", method, *args, **kwargs)
+
+    def shutdown(self):
+        return self.call("shutdown")
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+
+def attach(socket_path=None, timeout=None):
+    '''
+    Returns a SessionClient attached to the running tester session, or None if no session is listening on socket_path
+    '''
+    try:
+        return SessionClient(socket_path, timeout=timeout)
+    except socket.error, e:
+        if e.errno in (errno.ENOENT, errno.ECONNREFUSED):
+            return None
+        raise
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Hold a tester session open and serve it to scripts over a unix socket.')
+    parser.add_argument("--config", dest="config", help="Config file describing the cloud", default=None)
+    parser.add_argument("--password", dest="password", help="Root password of the cloud machines", default=None)
+    parser.add_argument("--keypath", dest="keypath", help="Ssh key of the cloud machines", default=None)
+    parser.add_argument("--credpath", dest="credpath", help="Directory holding existing credentials", default=None)
+    parser.add_argument("-a", "--account", dest="account", help="Account to use Default: eucalyptus", default="eucalyptus")
+    parser.add_argument("-u", "--user", dest="user", help="User to use Default: admin", default="admin")
+    parser.add_argument("-s", "--socket", dest="socket_path", help="Unix socket to listen on Default: " + get_default_socket_path(), default=None)
+    args = parser.parse_args()
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    from eucaops import Eucaops
+    tester = Eucaops(config_file=args.config, password=args.password, keypath=args.keypath, credpath=args.credpath, account=args.account, user=args.user)
+    server = SessionServer(tester, args.socket_path)
+    tester.debug("Tester session listening on " + server.socket_path)
+    server.serve()
@@ -0,0 +1,121 @@
+'''
+Runs commands on the local tester machine with the credential environment from a eucarc already loaded
+
+The eucarc is sourced once, in a single shell, and the resulting environment is kept and handed to every
+command afterwards, so each command costs one process spawn instead of a shell that re-sources the eucarc.
+The environment is reloaded automatically if the eucarc changes on disk.
+
+example usage:
+    import localshell
+    shell = localshell.LocalShell("eucarc-eucalyptus-admin/eucarc")
+    print shell.sys("euca-describe-availability-zones")
+    result = shell.run("euca-describe-instances")
+    print result['status'], result['stdout']
+    results = shell.run_many(["euca-describe-volumes", "euca-describe-snapshots"])
+'''
+
+import os
+import time
+import subprocess
+from multiprocessing.pool import ThreadPool
+
+
+class LocalShell(object):
+
+    def __init__(self, eucarc_path=None, shell="/bin/bash", debugmethod=None, verbose=False):
+        '''
+        eucarc_path - optional - string, path to a eucarc whose environment should be loaded for every command
+        shell - optional - string, shell used to source the eucarc
+        debugmethod - optional - method, used to handle debug msgs
+        verbose - optional - boolean to flag debug output on or off
+        '''
+        self.eucarc_path = eucarc_path
+        self.shell = shell
+        self.debugmethod = debugmethod
+        self.verbose = verbose
+        self.env = None
+        self.mtime = None
+        self.load_env()
+
+    def debug(self, msg):
+        '''
+        simple method for printing debug.
+        msg - mandatory - string to be printed
+        '''
+        if (self.verbose is True):
+            if (self.debugmethod is None):
+                print (str(msg))
+            else:
+                self.debugmethod(msg)
+
+    def load_env(self):
+        '''
+        Source the eucarc in a single shell and keep the resulting environment for later commands
+        '''
+        if (self.eucarc_path is None) or (not os.path.isfile(self.eucarc_path)):
+            self.env = dict(os.environ)
+            self.mtime = None
+            return
+        mtime = os.stat(self.eucarc_path).st_mtime
+        output = subprocess.Popen([self.shell, "-c", ". " + os.path.abspath(self.eucarc_path) + " >/dev/null && env -0"],
+                                  cwd=os.path.dirname(os.path.abspath(self.eucarc_path)),
+                                  stdout=subprocess.PIPE).communicate()[0]
+        env = {}
+        for entry in output.split("\0"):
+            if "=" in entry:
+                name, value = entry.split("=", 1)
+                env[name] = value
+        if not env:
+            raise Exception("Unable to load environment from " + self.eucarc_path)
+        self.env = env
+        self.mtime = mtime
+
+    def refresh(self):
+        '''
+        Reload the environment if the eucarc has changed since it was loaded
+        '''
+        if (self.eucarc_path is not None) and os.path.isfile(self.eucarc_path):
+            if os.stat(self.eucarc_path).st_mtime != self.mtime:
+                self.load_env()
+
+    def run(self, cmd, stdin=None):
+        '''
+        Run cmd locally and return a dictionary with the keys 'cmd', 'status' (exit code), 'stdout', 'stderr' and 'elapsed'
+        cmd - mandatory - string, the command to run
+        stdin - optional - string, data written to the command's stdin
+        '''
+        self.refresh()
+        start = time.time()
+        process = subprocess.Popen(cmd,
+                                   shell=True,
+                                   env=self.env,
+                                   stdin=subprocess.PIPE if stdin is not None else None,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate(stdin)
+        return {'cmd':cmd, 'status':process.returncode, 'stdout':stdout, 'stderr':stderr, 'elapsed':time.time() - start}
+
+    def sys(self, cmd):
+        '''
+        Run cmd locally and return its stdout as a list of lines
+        Anything written to stderr, and a non-zero exit status, is sent to debug
+        '''
+        result = self.run(cmd)
+        if result['stderr'] or (result['status'] != 0):
+            self.debug("Local command '" + cmd + "' exited with status " + str(result['status']) + ", stderr:\n" + result['stderr'].rstrip())
+        return result['stdout'].splitlines(True)
+
+    def run_many(self, cmds, workers=10):
+        '''
+        Run a list of commands locally at the same time using up to 'workers' threads
+        Returns a list of result dictionaries (see run()) in the same order as cmds
+        '''
+        if len(cmds) == 0:
+            return []
+        self.refresh()
+        pool = ThreadPool(min(workers, len(cmds)))
+        try:
+            return pool.map(self.run, cmds)
+        finally:
+            pool.close()
+            pool.join()
@@ -0,0 +1,121 @@
+'''
+Compressed, segmented archives of captured logs
+
+Each log gets one archive file, prefix + log + ".log.gz". Every call to add() streams a block of that log (ie what
+it gained during one test) through a compressor into a new gzip member appended to the end of the archive, so the
+whole file still reads with zcat while each member can be decompressed on its own. A small JSON manifest,
+prefix + "manifest.json", records for every member the test segment and log it holds, its offset and length in the
+archive, the number of uncompressed bytes and the time range it covers. One test's slice of a nightly run is read
+back by seeking straight to its member.
+
+example usage:
+    import logarchive
+    archive = logarchive.LogArchive("nightly-")
+    archive.add("test_attach_volume", "192.168.1.10-cloud-output", capture.read(start, end), start_time, end_time)
+    for entry in archive.get_entries(segment="test_attach_volume"):
+        print entry["log"], entry["bytes"]
+    print archive.read("test_attach_volume", "192.168.1.10-cloud-output")
+'''
+
+import os
+import gzip
+import json
+import zlib
+import time
+
+
+class LogArchive(object):
+
+    def __init__(self, prefix):
+        '''
+        prefix - mandatory - string, path prefix of the archive files and manifest, an existing manifest is appended to
+        '''
+        self.prefix = prefix
+        self.manifest_path = prefix + "manifest.json"
+        self.entries = []
+        if os.path.isfile(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.entries = json.load(f)["entries"]
+
+    def get_archive_path(self, log):
+        '''
+        Returns the path of the archive holding log
+        '''
+        return self.prefix + log + ".log.gz"
+
+    def add(self, segment, log, blocks, start_time=None, end_time=None):
+        '''
+        Compress blocks (any iterable of strings) into a new member at the end of log's archive and record it in the manifest
+        segment - mandatory - string, name of the test (or phase) the data belongs to
+        log - mandatory - string, name of the log the data came from
+        start_time, end_time - optional - time range covered by the data, end_time defaults to now
+        Returns the manifest entry, None if blocks held no data
+        '''
+        if end_time is None:
+            end_time = time.time()
+        path = self.get_archive_path(log)
+        with open(path, "ab") as f:
+            f.seek(0, os.SEEK_END)
+            offset = f.tell()
+            member = gzip.GzipFile(filename=log + ".log", mode="wb", fileobj=f)
+            size = 0
+            for block in blocks:
+                member.write(block)
+                size += len(block)
+            member.close()
+            if size == 0:
+                f.truncate(offset)
+                return None
+            length = f.tell() - offset
+        entry = {"segment": segment,
+                 "log": log,
+                 "archive": os.path.basename(path),
+                 "offset": offset,
+                 "length": length,
+                 "bytes": size,
+                 "start_time": start_time,
+                 "end_time": end_time}
+        self.entries.append(entry)
+        self.write_manifest()
+        return entry
+
+    def write_manifest(self):
+        '''
+        Write the manifest, through a temporary file so a crash never leaves a partial manifest behind
+        '''
+        with open(self.manifest_path + ".tmp", "w") as f:
+            json.dump({"entries": self.entries}, f, indent=1)
+        os.rename(self.manifest_path + ".tmp", self.manifest_path)
+
+    def get_entries(self, segment=None, log=None):
+        '''
+        Returns the manifest entries, only those of segment and/or log if given
+        '''
+        return [entry for entry in self.entries
+                if ((segment is None) or (entry["segment"] == segment)) and ((log is None) or (entry["log"] == log))]
+
+    def stream(self, entry, blocksize=1024*1024):
+        '''
+        Generator which yields the decompressed data of the member described by entry, without touching the rest of the archive
+        '''
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        with open(os.path.join(os.path.dirname(self.prefix), entry["archive"]), "rb") as f:
+            f.seek(entry["offset"])
+            remaining = entry["length"]
+            while remaining > 0:
+                block = f.read(min(blocksize, remaining))
+                if not block:
+                    break
+                remaining -= len(block)
+                data = decompressor.decompress(block)
+                if data:
+                    yield data
+        data = decompressor.flush()
+        if data:
+            yield data
+
+    def read(self, segment, log):
+        '''
+        Returns the data of log captured during segment as a string
+        '''
+        return "".join("".join(self.stream(entry)) for entry in self.get_entries(segment=segment, log=log))
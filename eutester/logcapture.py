@@ -0,0 +1,143 @@
+'''
+Bounded memory capture of a log stream which spills everything to disk as it arrives
+
+Every block written to a LogCapture is appended to the current segment file on disk straight away (and flushed, so
+the capture survives the tester crashing), while only the most recent tail_bytes are kept in memory for quick access.
+Segment files are rolled over every segment_bytes so no single file grows without bound during long soak runs.
+Captures are written to by the log tailer thread and can be read from any other thread at the same time.
+
+example usage:
+    import logcapture
+    capture = logcapture.LogCapture("clc", "/tmp/euca-logs", tail_bytes=1024*1024)
+    capture.write(data)
+    print capture.get_tail()
+    for block in capture.read():
+        archive.write(block)
+    capture.close()
+'''
+
+import os
+import time
+import threading
+import collections
+
+
+class LogCapture(object):
+
+    def __init__(self, name, directory, tail_bytes=1024*1024, segment_bytes=64*1024*1024):
+        '''
+        name - mandatory - string, name of the log, used to name its segment files
+        directory - mandatory - string, directory segment files are written to, created if needed
+        tail_bytes - optional - integer, number of bytes of the most recent data kept in memory
+        segment_bytes - optional - integer, size at which a new segment file is started
+        '''
+        self.name = name
+        self.directory = directory
+        self.tail_bytes = tail_bytes
+        self.segment_bytes = segment_bytes
+        self.tail = collections.deque()
+        self.tail_size = 0
+        self.size = 0
+        self.segments = []
+        self.segment_offsets = []
+        self.segment = None
+        self.segment_size = 0
+        self.created = time.time()
+        self.lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def get_segment_path(self, index):
+        '''
+        Returns the path of segment number index of this capture
+        '''
+        return os.path.join(self.directory, self.name + "." + "%04d" % index + ".log")
+
+    def open_segment(self):
+        '''
+        Close the current segment file and start the next one
+        '''
+        if self.segment is not None:
+            self.segment.close()
+        path = self.get_segment_path(len(self.segments))
+        self.segments.append(path)
+        self.segment_offsets.append(self.size)
+        self.segment = open(path, "wb")
+        self.segment_size = 0
+
+    def write(self, data):
+        '''
+        Append data to the capture, it is written to disk straight away and kept in the in memory tail
+        '''
+        if not data:
+            return
+        with self.lock:
+            if (self.segment is None) or (self.segment_size >= self.segment_bytes):
+                self.open_segment()
+            self.segment.write(data)
+            self.segment.flush()
+            self.segment_size += len(data)
+            self.size += len(data)
+            self.tail.append(data)
+            self.tail_size += len(data)
+            while self.tail_size - len(self.tail[0]) >= self.tail_bytes:
+                self.tail_size -= len(self.tail.popleft())
+
+    def get_tail(self):
+        '''
+        Returns (at least) the last tail_bytes of data written as a string
+        '''
+        with self.lock:
+            return "".join(self.tail)
+
+    def read(self, start=0, end=None, blocksize=1024*1024):
+        '''
+        Generator which yields the data written to the capture between the offsets start and end (defaults to everything) from disk
+        '''
+        with self.lock:
+            size = self.size
+            segments = list(self.segments)
+            segment_offsets = list(self.segment_offsets)
+        if end is None:
+            end = size
+        for index, path in enumerate(segments):
+            segment_start = segment_offsets[index]
+            if index + 1 < len(segments):
+                segment_end = segment_offsets[index + 1]
+            else:
+                segment_end = size
+            if (segment_end <= start) or (segment_start >= end):
+                continue
+            with open(path, "rb") as f:
+                position = max(start, segment_start)
+                f.seek(position - segment_start)
+                while position < min(end, segment_end):
+                    block = f.read(min(blocksize, min(end, segment_end) - position))
+                    if not block:
+                        break
+                    position += len(block)
+                    yield block
+
+    def readlines(self, start=0, end=None):
+        '''
+        Generator which yields the lines written to the capture between the offsets start and end from disk, one at a time
+        '''
+        partial = ""
+        for block in self.read(start, end):
+            lines = (partial + block).splitlines(True)
+            partial = ""
+            if lines and not lines[-1].endswith("\n"):
+                partial = lines.pop()
+            for line in lines:
+                yield line
+        if partial:
+            yield partial
+
+    def close(self):
+        '''
+        Close the current segment file, data already written stays on disk
+        '''
+        with self.lock:
+            if self.segment is not None:
+                self.segment.close()
+                self.segment = None
@@ -0,0 +1,85 @@
+'''
+Index of captured euca log lines by the resource ids they mention
+
+As each block of a log is captured it is split into lines and every resource id found in a line (instances, volumes,
+snapshots, images, reservations, elastic ip allocations) is recorded against the log and the offset and length of
+that line. Finding everything about vol-1234ABCD across every component is then a dictionary lookup followed by
+reading just those lines back from the capture, no matter how much log has been collected.
+
+example usage:
+    import logstore
+    store = logstore.LogStore()
+    store.set_components("192.168.1.10-cloud-output", ["clc", "ws"])
+    store.ingest("192.168.1.10-cloud-output", 0, data)
+    for name, offset, length in store.lookup("vol-1234ABCD", component="clc"):
+        print name, offset, length
+'''
+
+import re
+import threading
+
+RESOURCE_ID_RE = re.compile(r"\b(?:i|vol|snap|emi|eki|eri|r|eipalloc)-[0-9a-fA-F]{8,17}\b")
+
+
+class LogStore(object):
+
+    def __init__(self, id_re=RESOURCE_ID_RE):
+        '''
+        id_re - optional - compiled regex matching the ids to index, defaults to RESOURCE_ID_RE
+        '''
+        self.id_re = id_re
+        self.index = {}
+        self.components = {}
+        self.partial = {}
+        self.lines = 0
+        self.lock = threading.Lock()
+
+    def is_resource_id(self, value):
+        '''
+        Returns True if value is exactly one id this store indexes
+        '''
+        match = self.id_re.match(value)
+        return (match is not None) and (match.end() == len(value))
+
+    def set_components(self, name, components):
+        '''
+        Record the components (ie ["clc", "ws"]) whose messages end up in the log name
+        '''
+        with self.lock:
+            self.components[name] = [component.lower() for component in components]
+
+    def get_names(self, component):
+        '''
+        Returns the names of the logs holding the messages of component
+        '''
+        with self.lock:
+            return [name for name, components in self.components.iteritems() if component.lower() in components]
+
+    def ingest(self, name, offset, data):
+        '''
+        Index the complete lines in data, captured to the log name starting at offset
+        A partial last line is held until the rest of it arrives
+        '''
+        start, partial = self.partial.get(name, (offset, ""))
+        data = partial + data
+        end = data.rfind("\n") + 1
+        self.partial[name] = (start + end, data[end:])
+        position = start
+        with self.lock:
+            for line in data[:end].splitlines(True):
+                self.lines += 1
+                for resource_id in set(self.id_re.findall(line)):
+                    self.index.setdefault(resource_id, []).append((name, position, len(line)))
+                position += len(line)
+
+    def lookup(self, resource_id, component=None):
+        '''
+        Returns a list of (name, offset, length) of every captured line mentioning resource_id, in the order they were captured
+        component - optional - only return lines from the logs of this component, ie "nc00"
+        '''
+        with self.lock:
+            entries = list(self.index.get(resource_id, []))
+        if component is not None:
+            names = self.get_names(component)
+            entries = [entry for entry in entries if entry[0] in names]
+        return entries
@@ -0,0 +1,221 @@
+'''
+Tails any number of remote log files from a single thread
+
+Each log is followed by a tail -F running on its own channel of the (pooled) ssh connection to its host. One blocking
+select() waits on every channel at once plus a wakeup pipe, so the tailer sleeps until data arrives, drains everything
+that is ready from each channel in one pass and hands it to the callback, then goes back to waiting. Adding logs or
+stopping the tailer from another thread wakes it straight away.
+Several files on one host can share a single channel with add_files(), tail's "==> file <==" headers are used to split
+the stream back into one log per file.
+
+example usage:
+    import logtailer
+    def got_data(name, data):
+        print name, len(data)
+    tailer = logtailer.LogTailer(got_data)
+    tailer.add_file("clc", clc_machine.ssh, "/var/log/eucalyptus/cloud-output.log")
+    tailer.add_file("nc00", nc_machine.ssh, "/var/log/eucalyptus/nc.log")
+    tailer.add_files(clc_machine.ssh, {"/var/log/eucalyptus/cloud-output.log": "clc", "/var/log/messages": "clc-messages"})
+    tailer.start()
+    ...
+    tailer.stop()
+'''
+
+import os
+import re
+import socket
+import select
+import threading
+
+
+class LogTailer(object):
+
+    def __init__(self, callback, debugmethod=None, verbose=False):
+        '''
+        callback - mandatory - method called with (name, data) for every block of data read from a log
+        debugmethod - optional - method, used to handle debug msgs
+        verbose - optional - boolean to flag debug output on or off
+        '''
+        self.callback = callback
+        self.debugmethod = debugmethod
+        self.verbose = verbose
+        self.channels = {}
+        self.handlers = {}
+        self.closed = []
+        self.lock = threading.Lock()
+        self.stopped = False
+        self.thread = None
+        self.wakeup_read, self.wakeup_write = os.pipe()
+
+    def debug(self, msg):
+        '''
+        simple method for printing debug.
+        msg - mandatory - string to be printed
+        '''
+        if (self.verbose is True):
+            if (self.debugmethod is None):
+                print (str(msg))
+            else:
+                self.debugmethod(msg)
+
+    def wakeup(self):
+        '''
+        Interrupt the select() in run() so it picks up added channels or a stop request, does nothing once run() has finished
+        '''
+        with self.lock:
+            if self.wakeup_write is not None:
+                os.write(self.wakeup_write, "x")
+
+    def add(self, name, ssh, cmd, handler=None):
+        '''
+        Run cmd on the SshConnection ssh and deliver its output to the callback under name
+        handler - optional - method called with each block of output instead of the callback
+        '''
+        if handler is None:
+            handler = lambda data: self.callback(name, data)
+        chan = ssh.open_exec_channel(cmd)
+        chan.settimeout(0.0)
+        with self.lock:
+            self.channels[chan] = name
+            self.handlers[chan] = handler
+        self.debug("Tailing " + name + " on " + str(ssh.host) + ": " + cmd)
+        self.wakeup()
+        return chan
+
+    def add_file(self, name, ssh, path, lines=10):
+        '''
+        Follow the file at path on the SshConnection ssh (across log rotation) starting with its last 'lines' lines
+        '''
+        return self.add(name, ssh, self.get_tail_cmd([path], lines))
+
+    def add_files(self, ssh, names, lines=10):
+        '''
+        Follow several files on the SshConnection ssh with a single tail over one channel
+        names - mandatory - dictionary of path => name the data of that file is delivered to the callback under
+        '''
+        paths = sorted(names.keys())
+        demuxer = TailDemuxer(names, self.callback)
+        return self.add(str(ssh.host), ssh, self.get_tail_cmd(paths, lines, headers=True), handler=demuxer.feed)
+
+    def get_tail_cmd(self, paths, lines=10, headers=False):
+        '''
+        Returns the command used to follow paths, the pty is set not to turn newlines into CRLF and tail's own messages 
+        (ie about rotation) are kept out of the log data
+        '''
+        cmd = "stty -onlcr 2>/dev/null; exec tail -n " + str(lines) + " -F "
+        if headers:
+            cmd += "-v "
+        return cmd + " ".join(paths) + " 2>/dev/null"
+
+    def drain(self, chan):
+        '''
+        Read everything currently available on chan, returns the data and whether the channel has reached EOF
+        '''
+        buf = []
+        while True:
+            try:
+                data = chan.recv(32768)
+            except socket.timeout:
+                return "".join(buf), False
+            if not data:
+                return "".join(buf), True
+            buf.append(data)
+
+    def run(self):
+        '''
+        Deliver log data to the callback as it arrives until stop() is called, a tailer can only be run once
+        '''
+        while not self.stopped:
+            with self.lock:
+                channels = self.channels.keys()
+            readable, writable, errored = select.select(channels + [self.wakeup_read], [], [])
+            for chan in readable:
+                if chan == self.wakeup_read:
+                    os.read(self.wakeup_read, 4096)
+                    continue
+                data, eof = self.drain(chan)
+                name = self.channels[chan]
+                if data:
+                    self.handlers[chan](data)
+                if eof:
+                    with self.lock:
+                        del self.channels[chan]
+                        del self.handlers[chan]
+                    self.closed.append(name)
+                    chan.close()
+                    self.debug("Log channel for " + name + " closed")
+        with self.lock:
+            for chan in self.channels:
+                chan.close()
+            self.channels = {}
+            self.handlers = {}
+            os.close(self.wakeup_read)
+            os.close(self.wakeup_write)
+            self.wakeup_read = self.wakeup_write = None
+
+    def start(self):
+        '''
+        Run the tailer in a daemon thread
+        '''
+        self.thread = threading.Thread(target=self.run, args=())
+        self.thread.daemon = True
+        self.thread.start()
+        return self.thread
+
+    def stop(self, timeout=10):
+        '''
+        Stop the tailer and close its channels, waits up to timeout seconds for the tailer thread to finish
+        '''
+        self.stopped = True
+        self.wakeup()
+        if (self.thread is not None) and (self.thread is not threading.current_thread()):
+            self.thread.join(timeout)
+
+
+class TailDemuxer(object):
+    '''
+    Splits the output of a tail over several files back into one stream per file using tail's "==> file <==" headers
+    Data is passed on a line at a time, a partial last line is held until the rest of it arrives
+    '''
+    header_re = re.compile(r"^==> (.*) <==\n$")
+
+    def __init__(self, names, callback):
+        '''
+        names - mandatory - dictionary of path => name the data of that file is passed to callback under
+        callback - mandatory - method called with (name, data)
+        '''
+        self.names = names
+        self.callback = callback
+        self.current = None
+        self.partial = ""
+        self.blank = False
+
+    def emit(self, lines):
+        if lines and (self.current is not None):
+            self.callback(self.current, "".join(lines))
+
+    def feed(self, data):
+        '''
+        Pass the complete lines in data (plus any partial line held from before) on to the callback of the file they belong to
+        '''
+        data = self.partial + data
+        end = data.rfind("\n") + 1
+        self.partial = data[end:]
+        lines = []
+        for line in data[:end].splitlines(True):
+            match = self.header_re.match(line)
+            if match and (match.group(1) in self.names):
+                ### tail separates a header from the previous file's data with a blank line, drop it
+                self.blank = False
+                self.emit(lines)
+                lines = []
+                self.current = self.names[match.group(1)]
+                continue
+            if self.blank:
+                lines.append("\n")
+                self.blank = False
+            if line == "\n":
+                self.blank = True
+            else:
+                lines.append(line)
+        self.emit(lines)
@@ -19,16 +19,25 @@
 
 import eulogger
 import sshconnection
+import sftptransfer
 import re
 
-class machine:
-    def __init__(self, hostname, distro, distro_ver, arch, source, components, password=None, keypath=None, username="root", timeout=120,retry=2,debugmethod=None):
+class machine(object):
+    def __init__(self, hostname, distro, distro_ver, arch, source, components, password=None, keypath=None, username="root", timeout=120,retry=2,debugmethod=None, port=22, max_sessions=None, log_paths=None):
+        '''
+        The ssh and sftp sessions to this machine are not established until they are first used
+        port - optional - integer, tcp port of this machine's ssh server
+        max_sessions - optional - integer, most ssh channels opened to this machine at once by multiplexed commands
+        log_paths - optional - dictionary of component => path of the log file to collect for that component on this machine
+        '''
         self.hostname = hostname
         self.distro = distro
         self.distro_ver = distro_ver
         self.arch = arch
         self.source = source
         self.components = components
+        self.log_paths = log_paths or {}
+        self.debugmethod = debugmethod
         if debugmethod is None:
             logger = eulogger.Eulogger(identifier= str(hostname) + ":" + str(components))
             self.debugmethod = logger.log.debug
@@ -39,9 +48,26 @@ class machine:
                                                     timeout=timeout, 
                                                     retry=retry,
                                                     debugmethod=self.debugmethod,
-                                                    verbose=True)
+                                                    verbose=True,
+                                                    lazy=True,
+                                                    port=port,
+                                                    max_sessions=max_sessions)
+        self._sftp = None
+    
+    @property
+    def sftp(self):
+        '''
+        paramiko sftp client for this machine, opened on first use
+        '''
+        if self._sftp is None:
+            self._sftp = self.ssh.connection.open_sftp()
+        return self._sftp
     
-        self.sftp = self.ssh.connection.open_sftp()
+    def connect(self):
+        '''
+        Establish the ssh session to this machine now rather than on first use
+        '''
+        self.ssh.connect()
     
     def update_ssh(self):
         self.update()
@@ -74,21 +100,73 @@ class machine:
             except Exception, e:
                 pass
                 
-    def sys(self, cmd, verbose=True, timeout=120):
+    def sys(self, cmd, verbose=True, timeout=120, cb=None, tail=None):
         '''
         Issues a command against the ssh connection to this instance
         Returns a list of the lines from stdout+stderr as a result of the command
         cmd - mandatory - string, the command to be executed 
         verbose - optional - boolean flag to enable debug
         timeout - optional - command timeout in seconds 
+        cb - optional - method called with each line of output as it arrives
+        tail - optional - integer, only keep and return the last 'tail' lines of output
         '''
         output = []
         if (self.ssh is not None):
-            output = self.ssh.sys(cmd, verbose=verbose, timeout=timeout)
+            output = self.ssh.sys(cmd, verbose=verbose, timeout=timeout, cb=cb, tail=tail)
             return output
         else:
             raise Exception("Euinstance ssh connection is None")
     
+    def stream(self, cmd, verbose=True, timeout=120):
+        '''
+        Generator which issues a command against the ssh connection to this machine and yields each line of output as it arrives
+        cmd - mandatory - string, the command to be executed 
+        verbose - optional - boolean flag to enable debug
+        timeout - optional - command timeout in seconds 
+        '''
+        if (self.ssh is None):
+            raise Exception("Machine " + str(self.hostname) + " has no ssh connection")
+        return self.ssh.stream(cmd, verbose=verbose, timeout=timeout)
+    
+    def sys_raw(self, cmd, verbose=True, timeout=120, stdin=None):
+        '''
+        Issues a command against the ssh connection to this machine without a pty
+        Returns a dictionary with the keys 'cmd', 'status' (exit code), 'stdout', 'stderr' and 'elapsed', output is returned byte for byte
+        cmd - mandatory - string, the command to be executed 
+        verbose - optional - boolean flag to enable debug
+        timeout - optional - command timeout in seconds 
+        stdin - optional - string, data written to the command's stdin
+        '''
+        if (self.ssh is None):
+            raise Exception("Machine " + str(self.hostname) + " has no ssh connection")
+        return self.ssh.cmd_raw(cmd, verbose=verbose, timeout=timeout, stdin=stdin)
+    
+    def sys_batch(self, cmds, verbose=True, timeout=120):
+        '''
+        Issues a list of commands against the ssh connection to this machine in a single round trip
+        Returns a list of dictionaries with the keys 'cmd', 'output' and 'status', one per command in order
+        cmds - mandatory - list of strings, the commands to be executed 
+        verbose - optional - boolean flag to enable debug
+        timeout - optional - timeout in seconds for the whole batch
+        '''
+        if (self.ssh is None):
+            raise Exception("Machine " + str(self.hostname) + " has no ssh connection")
+        return self.ssh.sys_batch(cmds, verbose=verbose, timeout=timeout)
+    
+    def get_file(self, remotepath, localpath, **kwargs):
+        '''
+        Download remotepath from this machine to localpath using a chunked, resumable and md5 verified sftp transfer
+        Additional keyword arguments are passed to sftptransfer.SftpTransfer (chunk_size, workers, verify)
+        '''
+        return sftptransfer.SftpTransfer(self.ssh, debugmethod=self.debugmethod, **kwargs).get(remotepath, localpath)
+    
+    def put_file(self, localpath, remotepath, **kwargs):
+        '''
+        Upload localpath to remotepath on this machine using a chunked, resumable and md5 verified sftp transfer
+        Additional keyword arguments are passed to sftptransfer.SftpTransfer (chunk_size, workers, verify)
+        '''
+        return sftptransfer.SftpTransfer(self.ssh, debugmethod=self.debugmethod, **kwargs).put(localpath, remotepath)
+    
     def found(self, command, regex):
         """ Returns a Boolean of whether the result of the command contains the regex"""
         result = self.sys(command)
@@ -0,0 +1,262 @@
+'''
+Chunked, parallel and resumable file transfers over the sftp subsystem of an SshConnection
+
+Large files are split into chunk_size ranges which are moved by a pool of workers, each worker using its own
+sftp channel on the connection's (pooled) transport. Completed chunks are recorded in a small state file so an
+interrupted transfer picks up where it left off, and the result is verified against the remote md5sum before
+it is moved into place.
+
+example usage:
+    import sftptransfer
+    transfer = sftptransfer.SftpTransfer(machine.ssh)
+    transfer.get('/root/creds.zip', 'creds.zip')
+    transfer.put('/tmp/centos.img', '/root/centos.img')
+    errors = sftptransfer.put_to_many([m.ssh for m in machines], '/tmp/tools.tgz', '/root/tools.tgz')
+'''
+
+import os
+import time
+import hashlib
+import tempfile
+import threading
+import Queue
+from multiprocessing.pool import ThreadPool
+
+
+class SftpTransfer(object):
+
+    def __init__(self, ssh, chunk_size=8*1024*1024, workers=4, verify=True, debugmethod=None, verbose=False):
+        '''
+        ssh - mandatory - SshConnection object to transfer files over
+        chunk_size - optional - integer, size in bytes of each range moved by a worker
+        workers - optional - integer, maximum number of chunks (and sftp channels) in flight at once
+        verify - optional - boolean, compare md5sums of the local and remote file after the transfer
+        debugmethod - optional - method, used to handle debug msgs
+        verbose - optional - boolean to flag debug output on or off
+        '''
+        self.ssh = ssh
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.verify = verify
+        self.debugmethod = debugmethod
+        self.verbose = verbose
+
+    def debug(self,msg):
+        '''
+        simple method for printing debug.
+        msg - mandatory - string to be printed
+        '''
+        if (self.verbose is True):
+            if (self.debugmethod is None):
+                print (str(msg))
+            else:
+                self.debugmethod(msg)
+
+    def get(self, remotepath, localpath):
+        '''
+        Download remotepath from the remote host to localpath, resuming a previous partial download if one exists
+        remotepath - mandatory - string, path of the file on the remote host
+        localpath - mandatory - string, path to write the file to locally
+        '''
+        start = time.time()
+        sftp = self.ssh.connection.open_sftp()
+        try:
+            size = sftp.stat(remotepath).st_size
+        finally:
+            sftp.close()
+        partpath = localpath + ".part"
+        statepath = self.get_state_path("get", remotepath, localpath, size)
+        done = self.read_state(statepath)
+        if not os.path.exists(partpath):
+            ### a fresh transfer, chunks recorded by an earlier one were never written to this file
+            done = set()
+            self.remove_state(statepath)
+        with open(partpath, "ab") as part:
+            part.truncate(size)
+
+        def get_chunk(sftp, index, offset, length):
+            remote = sftp.open(remotepath, "r")
+            try:
+                data = "".join(remote.readv([(offset, length)]))
+            finally:
+                remote.close()
+            with open(partpath, "r+b") as part:
+                part.seek(offset)
+                part.write(data)
+
+        self.run_chunks(get_chunk, size, done, statepath)
+        if self.verify:
+            local_md5 = self.get_local_md5(partpath)
+            remote_md5 = self.get_remote_md5(remotepath)
+            if local_md5 != remote_md5:
+                self.remove_state(statepath, partpath)
+                raise IOError("md5sum mismatch after downloading " + remotepath + " local:" + local_md5 + " remote:" + remote_md5)
+        os.rename(partpath, localpath)
+        self.remove_state(statepath)
+        self.debug("Downloaded " + str(size) + " bytes from " + str(self.ssh.host) + ":" + remotepath + " in " + str(round(time.time() - start, 2)) + " seconds")
+        return localpath
+
+    def put(self, localpath, remotepath):
+        '''
+        Upload localpath to remotepath on the remote host, resuming a previous partial upload if one exists
+        localpath - mandatory - string, path of the local file to upload
+        remotepath - mandatory - string, path to write the file to on the remote host
+        '''
+        start = time.time()
+        size = os.path.getsize(localpath)
+        partpath = remotepath + ".part"
+        statepath = self.get_state_path("put", remotepath, localpath, size)
+        done = self.read_state(statepath)
+        sftp = self.ssh.connection.open_sftp()
+        try:
+            try:
+                sftp.stat(partpath)
+                remote = sftp.open(partpath, "r+")
+            except IOError:
+                done = set()
+                self.remove_state(statepath)
+                remote = sftp.open(partpath, "w")
+            remote.truncate(size)
+            remote.close()
+        finally:
+            sftp.close()
+
+        def put_chunk(sftp, index, offset, length):
+            with open(localpath, "rb") as local:
+                local.seek(offset)
+                data = local.read(length)
+            remote = sftp.open(partpath, "r+")
+            try:
+                remote.set_pipelined(True)
+                remote.seek(offset)
+                remote.write(data)
+            finally:
+                remote.close()
+
+        self.run_chunks(put_chunk, size, done, statepath)
+        if self.verify:
+            local_md5 = self.get_local_md5(localpath)
+            remote_md5 = self.get_remote_md5(partpath)
+            if local_md5 != remote_md5:
+                self.remove_state(statepath)
+                self.ssh.cmd("rm -f " + partpath, verbose=False)
+                raise IOError("md5sum mismatch after uploading " + localpath + " to " + str(self.ssh.host) + " local:" + local_md5 + " remote:" + remote_md5)
+        self.ssh.cmd("mv -f " + partpath + " " + remotepath, verbose=False)
+        self.remove_state(statepath)
+        self.debug("Uploaded " + str(size) + " bytes to " + str(self.ssh.host) + ":" + remotepath + " in " + str(round(time.time() - start, 2)) + " seconds")
+        return remotepath
+
+    def run_chunks(self, method, size, done, statepath):
+        '''
+        Call method(sftp, index, offset, length) for every chunk of a file of 'size' bytes that is not in 'done',
+        using up to self.workers threads each with their own sftp channel. Completed chunks are appended to the state file.
+        '''
+        chunks = []
+        index = 0
+        for offset in xrange(0, size, self.chunk_size):
+            if index not in done:
+                chunks.append((index, offset, min(self.chunk_size, size - offset)))
+            index += 1
+        if not chunks:
+            return
+        clients = Queue.Queue()
+        opened = []
+        state_lock = threading.Lock()
+
+        def run_chunk(chunk):
+            try:
+                sftp = clients.get_nowait()
+            except Queue.Empty:
+                sftp = self.ssh.connection.open_sftp()
+                with state_lock:
+                    opened.append(sftp)
+            try:
+                method(sftp, *chunk)
+            finally:
+                clients.put(sftp)
+            with state_lock:
+                with open(statepath, "a") as state:
+                    state.write(str(chunk[0]) + "\n")
+
+        pool = ThreadPool(max(1, min(self.workers, len(chunks))))
+        try:
+            pool.map(run_chunk, chunks)
+        finally:
+            pool.close()
+            pool.join()
+            for sftp in opened:
+                sftp.close()
+
+    def get_state_path(self, direction, remotepath, localpath, size):
+        '''
+        Returns the path of the local file used to record completed chunks for this transfer
+        '''
+        key = ":".join([direction, str(self.ssh.host), remotepath, os.path.abspath(localpath), str(size), str(self.chunk_size)])
+        return os.path.join(tempfile.gettempdir(), "eutester-transfer-" + hashlib.sha1(key).hexdigest())
+
+    def read_state(self, statepath):
+        '''
+        Returns the set of chunk indexes recorded as complete in statepath
+        '''
+        done = set()
+        if os.path.exists(statepath):
+            with open(statepath) as state:
+                for line in state:
+                    if line.strip().isdigit():
+                        done.add(int(line))
+        return done
+
+    def remove_state(self, statepath, partpath=None):
+        '''
+        Remove the state file and optionally the local partial file of a transfer
+        '''
+        for path in [statepath, partpath]:
+            if (path is not None) and os.path.exists(path):
+                os.remove(path)
+
+    def get_local_md5(self, path):
+        '''
+        Returns the md5 hex digest of a local file
+        '''
+        md5 = hashlib.md5()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024*1024), ""):
+                md5.update(block)
+        return md5.hexdigest()
+
+    def get_remote_md5(self, path):
+        '''
+        Returns the md5 hex digest of a file on the remote host
+        '''
+        output = self.ssh.sys("md5sum " + path, verbose=False)
+        if not output:
+            raise IOError("Unable to md5sum " + path + " on " + str(self.ssh.host))
+        return output[0].split()[0]
+
+
+def put_to_many(ssh_list, localpath, remotepath, workers=10, **kwargs):
+    '''
+    Upload localpath to remotepath on every SshConnection in ssh_list at once.
+    Returns a dictionary of host => None on success or the error string on failure
+    ssh_list - mandatory - list of SshConnection objects to upload to
+    localpath - mandatory - string, path of the local file to upload
+    remotepath - mandatory - string, path to write the file to on each remote host
+    workers - optional - integer, maximum number of hosts uploaded to at the same time
+    Additional keyword arguments are passed to each SftpTransfer
+    '''
+    if not ssh_list:
+        return {}
+
+    def put_to_host(ssh):
+        try:
+            SftpTransfer(ssh, **kwargs).put(localpath, remotepath)
+            return ssh.host, None
+        except Exception, e:
+            return ssh.host, str(e)
+
+    pool = ThreadPool(min(workers, len(ssh_list)))
+    try:
+        return dict(pool.map(put_to_host, ssh_list))
+    finally:
+        pool.close()
+        pool.join()
@@ -11,22 +11,180 @@ example usage:
 '''
 
 import time, os
-import paramiko
-from threading import Timer
-from boto.ec2 import keypair
+import re
+import random
+import socket
+import select
+import collections
+import hashlib
+import atexit
+import threading
+from multiprocessing.pool import ThreadPool
 
 
-class SshConnection():
+class SshConnectionPool(object):
+    '''
+    Process wide cache of authenticated paramiko SSHClients keyed by host, username and credential.
+    SshConnection objects and Eutester.create_ssh() get their clients from here so repeated connections 
+    to the same host reuse one transport (key exchange + auth happen once), each cmd() still opens a fresh 
+    channel on that transport. Clients are reference counted, each get() takes a reference and each release() 
+    (ie SshConnection.close()) drops one, a client is closed and removed from the pool when its last reference is released.
+    example usage:
+        client = sshconnection.connection_pool.get('192.168.1.1', password='foobar')
+        chan = client.get_transport().open_session()
+        sshconnection.connection_pool.release(client)
+    '''
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clients = {}
+        self.refcounts = {}
+        self.client_keys = {}
+        self.key_locks = {}
+        
+    def make_key(self, hostname, username="root", password=None, keypath=None, port=22):
+        '''
+        Returns the key used to index a connection in this pool. 
+        Passwords are hashed so they are not held in the key in clear text.
+        '''
+        if keypath is not None:
+            credential = "keypath:" + os.path.abspath(keypath)
+        else:
+            credential = "password:" + hashlib.sha1(str(password)).hexdigest()
+        return (str(hostname), int(port), str(username), credential)
+    
+    def is_active(self, client):
+        '''
+        Returns True if the client's transport is still connected and authenticated
+        '''
+        transport = client.get_transport()
+        return (transport is not None) and transport.is_active() and transport.is_authenticated()
+    
+    def get(self, hostname, username="root", password=None, keypath=None, timeout=60, retry=1, debugmethod=None, port=22):
+        '''
+        Returns an authenticated paramiko sshclient for hostname, reusing a pooled client when one is active. 
+        Every get() must be paired with a release() once the caller is done with the client, or the client stays open
+        until close_all() is called at exit. 
+        hostname - mandatory - hostname or ip to establish ssh connection with
+        username - optional - username used to authenticate ssh session
+        password - optional - password used to authenticate ssh session
+        keypath - optional - full path to sshkey file used to authenticate ssh session
+        timeout - optional - tcp timeout used if a new connection has to be made
+        retry - optional - amount of retry attempts to establish ssh connection for errors outside of authentication
+        debugmethod - optional - method used to print debug
+        port - optional - tcp port the ssh server listens on
+        '''
+        if ((password is None) and (keypath is None)):
+            raise Exception("ssh_connect: both password and keypath were set to None")
+        key = self.make_key(hostname, username=username, password=password, keypath=keypath, port=port)
+        with self.lock:
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+        #only one thread connects to a given host/user/credential at a time, others wait and reuse its client
+        with key_lock:
+            with self.lock:
+                client = self.clients.get(key)
+                if client is not None:
+                    #take the reference straight away so a concurrent release() can not close the client under us
+                    self.refcounts[key] += 1
+            if (client is not None) and (not self.is_active(client)):
+                self.discard(key)
+                client = None
+            if client is None:
+                client = self.connect(hostname, username=username, password=password, keypath=keypath, timeout=timeout, retry=retry, debugmethod=debugmethod, port=port)
+                with self.lock:
+                    self.clients[key] = client
+                    self.refcounts[key] = 1
+                    self.client_keys[client] = key
+        return client
+    
+    def connect(self, hostname, username="root", password=None, keypath=None, timeout=60, retry=1, debugmethod=None, port=22):
+        '''
+        Create a new paramiko ssh session to hostname, this does not add the client to the pool.
+        Will attempt to authenticate first with a keypath if provided, 
+        if the sshkey file path is not provided.  username and password will be used to authenticate. 
+        paramiko is imported here, by the first connection made, rather than when this module is imported
+        '''
+        import paramiko
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    
+        while ( retry >= 0  ):
+            retry -= 1 
+            try:
+                if keypath is None:   
+                    ssh.connect(hostname, port=port, username=username, password=password, timeout= timeout)
+                else:
+                    ssh.connect(hostname, port=port, username=username, key_filename=keypath, timeout= timeout)
+                break
+            except paramiko.ssh_exception.SSHException, se:
+                if retry < 0: 
+                    if debugmethod is not None:
+                        debugmethod("Failed to connect to "+hostname+", retry in 10 seconds")
+                    time.sleep(10)
+                    pass
+                else:
+                    raise se
+        return ssh
+    
+    def release(self, client):
+        '''
+        Drop a reference to client, the client is closed and removed from the pool once nothing else is using it
+        '''
+        with self.lock:
+            key = self.client_keys.get(client)
+            if key is None:
+                return
+            self.refcounts[key] -= 1
+            if self.refcounts[key] > 0:
+                return
+            self.clients.pop(key, None)
+            self.refcounts.pop(key, None)
+            self.client_keys.pop(client, None)
+        try:
+            client.close()
+        except Exception:
+            pass
+    
+    def discard(self, key):
+        '''
+        Close and remove the client stored under key from the pool
+        '''
+        with self.lock:
+            client = self.clients.pop(key, None)
+            self.refcounts.pop(key, None)
+            self.client_keys.pop(client, None)
+        if client is not None:
+            try:
+                client.close()
+            except Exception:
+                pass
+    
+    def close_all(self):
+        '''
+        Close every pooled client
+        '''
+        with self.lock:
+            keys = self.clients.keys()
+        for key in keys:
+            self.discard(key)
+            
+            
+connection_pool = SshConnectionPool()
+atexit.register(connection_pool.close_all)
+
+
+class SshConnection(object):
     host = None
     username = None
     password = None
     keypair = None
     keypath = None
-    connection = None
     debugmethod = None
     timeout = 60
     retry = 1
     verbose = False
+    port = 22
+    max_sessions = None
     
     def __init__(self, 
                  host, 
@@ -37,7 +195,10 @@ class SshConnection():
                  timeout=60, 
                  retry=1,
                  debugmethod=None,
-                 verbose=False):
+                 verbose=False,
+                 lazy=False,
+                 port=22,
+                 max_sessions=None):
         '''
         host -mandatory - string, hostname or ip address to establish ssh connection to
         username - optional - string, username used to establish ssh session when keypath is not provided
@@ -48,6 +209,9 @@ class SshConnection():
         retry - optional - integer, # of attempts made to establish ssh session without auth failures
         debugmethod - method, used to handle debug msgs
         verbose - optional - boolean to flag debug output on or off
+        lazy - optional - boolean, if set the ssh session is not established until the connection is first used
+        port - optional - integer, tcp port the ssh server listens on
+        max_sessions - optional - integer, most channels SshMultiplexer keeps open on this host at once (sshd's MaxSessions)
         '''
         
         self.host = host
@@ -59,19 +223,49 @@ class SshConnection():
         self.retry = retry
         self.debugmethod = debugmethod
         self.verbose = verbose
-        
+        self.port = port
+        self.max_sessions = max_sessions
+        self._connection = None
+        self.connect_lock = threading.Lock()
         
         if (self.keypair is not None):
             self.keypath = os.getcwd() + "/" + self.keypair.name + ".pem"
         if (self.keypath is not None):
-            self.debug( "SSH connection has hostname:"+self.host+" and keypath: "+self.keypath)
+            self.debug( "SSH connection has hostname:"+str(self.host)+" and keypath: "+self.keypath)
         else:
-            self.debug( "SSH connection has hostname:"+self.host+" user:"+self.username+" password:"+self.password)
+            self.debug( "SSH connection has hostname:"+str(self.host)+" user:"+self.username+" password:"+self.password)
             
-        if (self.keypath is not None) or ((self.username is not None) and (self.password is not None)):
-            self.connection = self.get_ssh_connection(self.host, username=self.username, password=self.password, keypath=self.keypath, timeout=self.timeout)
-        else:
+        if (self.keypath is None) and ((self.username is None) or (self.password is None)):
             raise Exception("Need either a keypath or username+password to create ssh connection")
+        if not lazy:
+            self.connect()
+    
+    @property
+    def connection(self):
+        '''
+        The paramiko sshclient for this session, the session is established (or re-established if its transport has dropped) on first use
+        '''
+        if (self._connection is None) or (not connection_pool.is_active(self._connection)):
+            self.connect()
+        return self._connection
+    
+    def connect(self):
+        '''
+        Establish this session's ssh connection through the shared pool if it is not already connected, returns the paramiko sshclient
+        '''
+        with self.connect_lock:
+            if (self._connection is not None) and connection_pool.is_active(self._connection):
+                return self._connection
+            if self._connection is not None:
+                connection_pool.release(self._connection)
+            self._connection = self.get_ssh_connection(self.host, username=self.username, password=self.password, keypath=self.keypath, timeout=self.timeout, retry=self.retry, port=self.port)
+            return self._connection
+    
+    def is_connected(self):
+        '''
+        Returns True if this session has an active ssh connection, does not attempt to connect
+        '''
+        return (self._connection is not None) and connection_pool.is_active(self._connection)
     
     def debug(self,msg):
         '''
@@ -85,28 +279,120 @@ class SshConnection():
             else:
                 self.debugmethod(msg)
 
-    def ssh_sys_timeout(self,chan,start):
+    def read_channel(self, chan, deadline):
+        '''
+        Generator which yields the data read from chan until the remote command closes its output. 
+        The read blocks on the channel itself with a timeout of the time left until deadline, so no timer thread is needed
+        and CommandTimeoutException is raised in the calling thread.
+        chan - mandatory - paramiko channel the command has been executed on
+        deadline - mandatory - time.time() value after which the command is considered timed out
+        '''
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                chan.close()
+                raise CommandTimeoutException("SSH Command did not complete before its deadline")
+            chan.settimeout(remaining)
+            try:
+                data = chan.recv(32768)
+            except socket.timeout:
+                continue
+            if not data:
+                return
+            yield data
+    
+    def get_exit_status(self, chan, deadline):
+        '''
+        Wait until deadline for the exit status of the command run on chan and return it
+        chan - mandatory - paramiko channel the command has been executed on
+        deadline - mandatory - time.time() value after which the command is considered timed out
+        '''
+        if not chan.status_event.wait(max(0, deadline - time.time())):
+            chan.close()
+            raise CommandTimeoutException("SSH Command timed out waiting for exit status")
+        return chan.recv_exit_status()
+    
+    def read_lines(self, chan, deadline):
         '''
-        callback to be scheduled during ssh cmds which have timed out. 
-        chan - paramiko channel to be closed 
-        start - time.time() used to calc elapsed time when this fired for debug
+        Generator which yields each line of output from chan as soon as it is complete, lines keep their trailing newline
+        chan - mandatory - paramiko channel the command has been executed on
+        deadline - mandatory - time.time() value after which the command is considered timed out
         '''
-        chan.close()
-        elapsed = time.time()-start
-        raise CommandTimeoutException("SSH Command timer has fired after scheduled "+str(elapsed).split('.')[0]+" seconds")   
+        pending = []
+        for data in self.read_channel(chan, deadline):
+            if '\n' not in data:
+                pending.append(data)
+                continue
+            pending.append(data)
+            lines = "".join(pending).split('\n')
+            last = lines.pop()
+            pending = [last] if last else []
+            for line in lines:
+                yield line + '\n'
+        if pending:
+            yield "".join(pending)
     
-     
-    def sys(self, cmd, verbose=None, timeout=120):
+    def split_lines(self, buf):
+        '''
+        Split buf into a list of lines, each line keeps its trailing newline (same format as file.readlines())
+        '''
+        lines = buf.split('\n')
+        last = lines.pop()
+        lines = [line + '\n' for line in lines]
+        if last:
+            lines.append(last)
+        return lines
+    
+    def sys(self, cmd, verbose=None, timeout=120, cb=None, tail=None):
         '''
         Issue a command cmd and return output in list format
         cmd - mandatory - string representing the command to be run  against the remote ssh session
         verbose - optional - will default to global setting, can be set per cmd() as well here
         timeout - optional - integer used to timeout the overall cmd() operation in case of remote blockingd
+        cb - optional - method called with each line of output as it arrives
+        tail - optional - integer, only keep the last 'tail' lines of output in memory and return those
         '''
-        return self.cmd(cmd, verbose=verbose, timeout=timeout, listformat=True)
+        return self.cmd(cmd, verbose=verbose, timeout=timeout, listformat=True, cb=cb, tail=tail)
     
+    def stream(self, cmd, verbose=None, timeout=120):
+        '''
+        Generator which runs cmd and yields each line of output as it arrives rather than buffering the whole result.
+        Example:
+            for line in ssh.stream('dd if=/dev/zero of=/dev/vdb bs=1M count=4096', timeout=600):
+                print line
+        cmd - mandatory - string representing the command to be run  against the remote ssh session
+        verbose - optional - will default to global setting, prints each line through debug() as it arrives
+        timeout - optional - integer used to timeout the overall operation in case of remote blocking
+        '''
+        if verbose is None:
+            verbose = self.verbose
+        cmd = str(cmd)
+        if verbose:
+            self.debug( "[root@" + str(self.host) + "]# " + cmd)
+        chan = self.open_exec_channel(cmd)
+        try:
+            for line in self.read_lines(chan, time.time() + timeout):
+                if verbose:
+                    self.debug(line.rstrip())
+                yield line
+        finally:
+            chan.close()
+    
+    def open_exec_channel(self, cmd):
+        '''
+        Open a new session channel with a pty on this connection's transport and execute cmd on it, returns the channel
+        '''
+        tran = self.connection.get_transport()
+        chan = tran.open_session()
+        try:
+            chan.get_pty()
+            chan.exec_command(cmd)
+        except:
+            chan.close()
+            raise
+        return chan
     
-    def cmd(self, cmd, verbose=None, timeout=120, listformat=False):
+    def cmd(self, cmd, verbose=None, timeout=120, listformat=False, get_status=False, cb=None, tail=None):
         """ 
         Runs a command 'cmd' within an ssh connection. 
         Upon success returns a list of lines from the output of the command.
@@ -114,52 +400,140 @@ class SshConnection():
         verbose - optional - will default to global setting, can be set per cmd() as well here
         timeout - optional - integer used to timeout the overall cmd() operation in case of remote blocking
         listformat - optional - boolean, if set returns output as list of lines, else a single buffer/string
+        get_status - optional - boolean, if set returns a dictionary with the keys 'cmd', 'output', 'status' (exit code) and 'elapsed'
+        cb - optional - method called with each line of output as it arrives, for watching long running commands
+        tail - optional - integer, only keep the last 'tail' lines of output in memory and return those
         """
             
         if verbose is None:
             verbose = self.verbose
             
         cmd = str(cmd)
-        t = None #used for timer 
+        chan = None
         start = time.time()
+        deadline = start + timeout
         output = []
         if verbose:
             self.debug( "[root@" + str(self.host) + "]# " + cmd)
         try:
-            tran = self.connection.get_transport()
-            chan = tran.open_session()
-            chan.get_pty()
-            f = chan.makefile()
-            t = Timer(timeout, self.ssh_sys_timeout,[chan, start] )
-            t.start()
-            chan.exec_command(cmd)
-            if ( listformat is True):
-                #return output as list of lines
-                output = f.readlines()
+            chan = self.open_exec_channel(cmd)
+            if (cb is None) and (tail is None):
+                output = "".join(self.read_channel(chan, deadline))
+                if ( listformat is True):
+                    #return output as list of lines
+                    output = self.split_lines(output)
             else:
-                #return output as single string buffer
-                output = f.read()
+                #handle output line by line, only holding on to the last 'tail' lines
+                lines = collections.deque(maxlen=tail)
+                for line in self.read_lines(chan, deadline):
+                    if cb is not None:
+                        cb(line)
+                    lines.append(line)
+                output = list(lines)
+                if ( listformat is not True):
+                    output = "".join(output)
+            status = self.get_exit_status(chan, deadline)
         except CommandTimeoutException, cte: 
             elapsed = str(time.time()-start).split('.')[0]
             self.debug("Command ("+cmd+") timed out after " + str(elapsed) + " seconds\nException")     
             raise cte
         finally:
-            if (t is not None):
-                t.cancel()          
+            if (chan is not None):
+                chan.close()
         if verbose:
             elapsed = str(time.time()-start).split('.')[0]
             if (listformat is True):
                 self.debug("".join(output))
             else:
                 self.debug(output)
-                
+        if get_status:
+            return {'cmd':cmd, 'output':output, 'status':status, 'elapsed':time.time()-start}
         return output
         
         
     
-    def get_ssh_connection(self, hostname, username="root", password=None, keypath=None, timeout= 60, retry=1):
+    def cmd_raw(self, cmd, verbose=None, timeout=120, stdin=None):
+        '''
+        Runs cmd without a pty, so stdout and stderr stay separate, no terminal processing or CRLF translation is applied 
+        and the output is returned byte for byte (safe for checksums and block data).
+        Returns a dictionary with the keys 'cmd', 'status' (exit code), 'stdout', 'stderr' and 'elapsed'
+        Example:
+            result = ssh.cmd_raw('cat /dev/vdb | md5sum')
+            if result['status'] == 0: md5 = result['stdout'].split()[0]
+        cmd - mandatory - string representing the command to be run  against the remote ssh session
+        verbose - optional - will default to global setting, can be set per cmd_raw() as well here
+        timeout - optional - integer used to timeout the overall operation in case of remote blocking
+        stdin - optional - string, data written to the command's stdin before it is closed
+        '''
+        if verbose is None:
+            verbose = self.verbose
+        cmd = str(cmd)
+        start = time.time()
+        deadline = start + timeout
+        stdout = []
+        stderr = []
+        if verbose:
+            self.debug( "[root@" + str(self.host) + "]# " + cmd)
+        chan = self.connection.get_transport().open_session()
+        try:
+            chan.exec_command(cmd)
+            if stdin is not None:
+                chan.sendall(stdin)
+            chan.shutdown_write()
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    elapsed = str(time.time()-start).split('.')[0]
+                    self.debug("Command ("+cmd+") timed out after " + str(elapsed) + " seconds")
+                    raise CommandTimeoutException("SSH Command did not complete before its deadline")
+                #the channel's fd only signals stdout, so wake up regularly to drain stderr as well
+                select.select([chan], [], [], min(0.1, remaining))
+                while chan.recv_stderr_ready():
+                    stderr.append(chan.recv_stderr(32768))
+                while chan.recv_ready():
+                    stdout.append(chan.recv(32768))
+                if chan.exit_status_ready() and not chan.recv_ready() and not chan.recv_stderr_ready():
+                    break
+            status = chan.recv_exit_status()
+        finally:
+            chan.close()
+        result = {'cmd':cmd, 'status':status, 'stdout':"".join(stdout), 'stderr':"".join(stderr), 'elapsed':time.time()-start}
+        if verbose:
+            self.debug("exit status:" + str(status) + " stdout:" + str(len(result['stdout'])) + " bytes, stderr:" + str(len(result['stderr'])) + " bytes")
+        return result
+    
+    def sys_batch(self, cmds, verbose=None, timeout=120):
+        '''
+        Runs a list of commands in a single remote exec (one channel round trip) instead of one cmd() per command.
+        Each command is run in its own subshell between unique delimiter lines, so a failing command does not stop the rest.
+        Returns a list of dictionaries, one per command in order, with the keys 'cmd', 'output' (list of lines) and 'status' (exit code).
+        Example:
+            results = ssh.sys_batch(['ls -1 /dev/vdb', 'stat /root/test.txt', 'uptime'])
+            if results[0]['status'] != 0: print "vdb not found"
+        cmds - mandatory - list of command strings to run
+        verbose - optional - will default to global setting
+        timeout - optional - integer used to timeout the whole batch
         '''
-        Create a paramiko ssh session to hostname. Will attempt to authenticate first with a keypath if provided, 
+        marker = "EUTESTER_BATCH_" + "%016x" % random.getrandbits(64)
+        script = []
+        for index, cmd in enumerate(cmds):
+            script.append("echo " + marker + ":" + str(index) + ":BEGIN")
+            script.append("( " + str(cmd) + "\n)")
+            script.append("echo " + marker + ":" + str(index) + ":END:$?")
+        output = self.cmd("\n".join(script), verbose=verbose, timeout=timeout)
+        results = [{'cmd':str(cmd), 'output':[], 'status':None} for cmd in cmds]
+        pattern = re.compile(marker + r":(\d+):BEGIN\r?\n(.*?)" + marker + r":\1:END:(\d+)", re.DOTALL)
+        for match in pattern.finditer(output):
+            result = results[int(match.group(1))]
+            result['output'] = self.split_lines(match.group(2))
+            result['status'] = int(match.group(3))
+        return results
+    
+    def get_ssh_connection(self, hostname, username="root", password=None, keypath=None, timeout= 60, retry=1, port=22):
+        '''
+        Get a paramiko ssh session to hostname from the shared connection pool, a new session is only made if 
+        there is not already an active one for this hostname, username and credential. 
+        Will attempt to authenticate first with a keypath if provided, 
         if the sshkey file path is not provided.  username and password will be used to authenticate. 
         Upon success returns a paramiko sshclient with an established connection. 
         hostname - mandatory - hostname or ip to establish ssh connection with
@@ -168,39 +542,192 @@ class SshConnection():
         keypath - optional - full path to sshkey file used to authenticate ssh session
         timeout - optional - tcp timeout 
         retry - optional - amount of retry attempts to establish ssh connection for errors outside of authentication
+        port - optional - tcp port the ssh server listens on
         '''
-        if ((password is None) and (keypath is None)):
-            raise Exception("ssh_connect: both password and keypath were set to None")
+        return connection_pool.get(hostname, username=username, password=password, keypath=keypath, timeout=timeout, retry=retry, debugmethod=self.debug, port=port)
+    
+    def close(self):
+        '''
+        Release this session's connection back to the shared pool, the transport is closed once no other session uses it
+        '''
+        with self.connect_lock:
+            if self._connection is not None:
+                connection_pool.release(self._connection)
+                self._connection = None
         
-        #self.debug("ssh_connect args:\nhostname:"+hostname+"\nusername:"+username+"\npassword:"+str(password)+"\nkeypath:"+str(keypath)+"\ntimeout:"+str(timeout)+"\nretry:"+str(retry))
-
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        
+        
+class SshMultiplexer(object):
+    '''
+    Runs commands over many SshConnections at once from the calling thread. 
+    Instead of a thread per session, every open channel is watched with a single select() loop and 
+    drained as its data arrives, so one tester process can drive a large number of instances. 
+    Channels ride on the shared pooled transports, at most max_open commands are in flight at a time and 
+    no more than a connection's max_sessions (when set) are open on any one host. 
+    Sessions which are not connected yet (ie lazy EuInstance sessions) are connected concurrently by up to 
+    connect_workers threads before any command starts, a host that cannot be reached only fails its own commands. 
+    example usage:
+        mux = SshMultiplexer()
+        for instance in reservation.instances:
+            mux.add(instance.ssh, 'ls -1 /dev/')
+        for result in mux.run(timeout=60):
+            print result['host'], result['status'], result['output']
+    '''
     
-        while ( retry >= 0  ):
-            retry -= 1 
+    def __init__(self, max_open=200, debugmethod=None, verbose=False, connect_workers=20):
+        '''
+        max_open - optional - integer, maximum number of channels open at once (select() is limited to ~1024 fds)
+        connect_workers - optional - integer, maximum number of sessions connected at the same time
+        debugmethod - optional - method, used to handle debug msgs
+        verbose - optional - boolean to flag debug output on or off
+        '''
+        self.max_open = max_open
+        self.connect_workers = connect_workers
+        self.debugmethod = debugmethod
+        self.verbose = verbose
+        self.jobs = []
+        
+    def debug(self,msg):
+        '''
+        simple method for printing debug. 
+        msg - mandatory - string to be printed
+        '''
+        if (self.verbose is True):
+            if (self.debugmethod is None):
+                print (str(msg))
+            else:
+                self.debugmethod(msg)
+    
+    def add(self, ssh, cmd):
+        '''
+        Queue cmd to be run on the SshConnection ssh, returns the index of its result in the list returned by run()
+        ssh - mandatory - SshConnection object to run the command on
+        cmd - mandatory - string representing the command to be run
+        '''
+        self.jobs.append({'ssh':ssh, 'cmd':str(cmd)})
+        return len(self.jobs) - 1
+    
+    def connect_sessions(self, sessions):
+        '''
+        Start connecting the sessions which are not connected yet, in the background with up to connect_workers threads
+        Returns a dictionary of session => None while it is connecting, True once connected or the error string if it failed
+        '''
+        states = {}
+        unconnected = []
+        for ssh in sessions:
+            if (ssh not in states) and (not ssh.is_connected()):
+                states[ssh] = None
+                unconnected.append(ssh)
+        if len(unconnected) == 0:
+            return states
+        def connect_session(ssh):
             try:
-                #self.debug("Attempting SSH connection: "+username+"@"+hostname )            
-                if keypath is None:   
-                    #self.debug("Using username:"+username+" and password:"+password)
-                    ssh.connect(hostname, username="root", password=password, timeout= timeout)
-                else:
-                    #self.debug("Using Keypath:"+keypath)
-                    ssh.connect(hostname,  username="root", key_filename=keypath, timeout= timeout)
-                break
-            except paramiko.ssh_exception.SSHException, se:
-                if retry < 0: 
-                    self.debug("Failed to connect to "+hostname+", retry in 10 seconds")
-                    time.sleep(10)
-                    pass
-                else:
-                    raise se
-        #self.debug("Returning ssh connection to: "+ hostname)
-        return ssh
+                ssh.connect()
+                states[ssh] = True
+            except Exception, e:
+                states[ssh] = "SSH session could not be established: " + str(e)
+                self.debug("Unable to connect to " + str(ssh.host) + ": " + str(e))
+        pool = ThreadPool(min(self.connect_workers, len(unconnected)))
+        for ssh in unconnected:
+            pool.apply_async(connect_session, (ssh,))
+        #sessions still connecting when run() reaches its deadline are left to finish in the background
+        pool.close()
+        return states
     
-    def close(self):     
-        self.connection.close()
-        
+    def run(self, timeout=120, listformat=True):
+        '''
+        Run all queued commands and wait for them to complete, the queue is emptied afterwards. 
+        Returns a list of dictionaries in the order commands were added with the keys 
+        'host', 'cmd', 'output', 'status' (exit code), 'elapsed' and 'error' (None unless the command failed to run or timed out)
+        timeout - optional - integer, overall time in seconds allowed for every command to complete
+        listformat - optional - boolean, if set output is a list of lines, else a single buffer/string
+        '''
+        jobs = self.jobs
+        self.jobs = []
+        start = time.time()
+        deadline = start + timeout
+        results = [{'host':job['ssh'].host, 'cmd':job['cmd'], 'output':[], 'status':None, 'elapsed':0, 'error':None} for job in jobs]
+        connecting = self.connect_sessions([job['ssh'] for job in jobs])
+        pending = range(len(jobs))
+        pending.reverse()
+        channels = {}
+        buffers = {}
+        host_open = {}
+        while pending or channels:
+            #keep up to max_open channels in flight, skipping jobs whose host is at its max_sessions
+            position = len(pending) - 1
+            while (position >= 0) and (len(channels) < self.max_open) and (time.time() < deadline):
+                index = pending[position]
+                ssh = jobs[index]['ssh']
+                position -= 1
+                if ssh in connecting:
+                    if connecting[ssh] is None:
+                        continue
+                    if connecting[ssh] is not True:
+                        del pending[position + 1]
+                        results[index]['error'] = connecting[ssh]
+                        results[index]['elapsed'] = time.time() - start
+                        continue
+                if (ssh.max_sessions is not None) and (host_open.get(ssh.host, 0) >= ssh.max_sessions):
+                    continue
+                del pending[position + 1]
+                try:
+                    chan = ssh.open_exec_channel(jobs[index]['cmd'])
+                    chan.settimeout(0.0)
+                    channels[chan] = index
+                    buffers[index] = []
+                    host_open[ssh.host] = host_open.get(ssh.host, 0) + 1
+                except Exception, e:
+                    results[index]['error'] = str(e)
+                    results[index]['elapsed'] = time.time() - start
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            #while sessions are still connecting wake up regularly to start their commands
+            if None in connecting.values():
+                remaining = min(remaining, 0.05)
+            if not channels:
+                time.sleep(remaining)
+                continue
+            readable, writable, errored = select.select(channels.keys(), [], [], remaining)
+            for chan in readable:
+                index = channels[chan]
+                eof = False
+                while True:
+                    try:
+                        data = chan.recv(32768)
+                    except socket.timeout:
+                        break
+                    if not data:
+                        eof = True
+                        break
+                    buffers[index].append(data)
+                if eof:
+                    del channels[chan]
+                    host_open[jobs[index]['ssh'].host] -= 1
+                    if chan.status_event.wait(max(0, deadline - time.time())):
+                        results[index]['status'] = chan.recv_exit_status()
+                    results[index]['elapsed'] = time.time() - start
+                    chan.close()
+        #anything still open has run past the deadline
+        for chan, index in channels.iteritems():
+            chan.close()
+            results[index]['error'] = "SSH Command did not complete before its deadline"
+            results[index]['elapsed'] = time.time() - start
+        for index in pending:
+            if connecting.get(jobs[index]['ssh'], True) is None:
+                results[index]['error'] = "SSH session was not established before the deadline"
+            else:
+                results[index]['error'] = "SSH Command was not started before its deadline"
+        for index, result in enumerate(results):
+            output = "".join(buffers.get(index, []))
+            if listformat:
+                output = jobs[index]['ssh'].split_lines(output)
+            result['output'] = output
+            if result['error'] is not None:
+                self.debug("Command (" + result['cmd'] + ") on " + str(result['host']) + " failed: " + result['error'])
+        self.debug("Ran " + str(len(jobs)) + " commands in " + str(round(time.time() - start, 2)) + " seconds")
+        return results
         
         
 class CommandTimeoutException(Exception):
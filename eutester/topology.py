@@ -0,0 +1,92 @@
+'''
+Indexed view of the machines making up a cloud
+
+Machines are indexed by exact hostname, by component (clc, ws, cc00, sc00, nc00...) and by partition (the cluster
+number of cc/sc/nc components) when they are added, so lookups are dictionary hits instead of scans of the machine
+list. Lookups by an address the config does not use (ie a service URL with an IP for a machine listed by hostname)
+fall back to an index of resolved addresses which is built once, the first time it is needed.
+
+example usage:
+    from topology import Topology
+    topology = Topology(machines)
+    clc = topology.get_component_machines("clc")[0]
+    machine = topology.get_machine("192.168.51.32")
+    cluster_machines = topology.get_partition_machines("PARTI00")
+'''
+
+import re
+import socket
+
+
+class Topology(object):
+
+    def __init__(self, machines=None):
+        '''
+        machines - optional - list of machine objects to index
+        '''
+        self.machines = []
+        self.by_host = {}
+        self.by_component = {}
+        self.by_partition = {}
+        self.by_address = None
+        for machine in machines or []:
+            self.add(machine)
+
+    def get_partition(self, name):
+        '''
+        Returns the partition number in a component or partition name, ie "00" for "nc00" or "PARTI00", or None
+        '''
+        match = re.search(r"(\d+)$", str(name))
+        if match:
+            return match.group(1)
+        return None
+
+    def add(self, machine):
+        '''
+        Add a machine to the topology and its indexes
+        '''
+        self.machines.append(machine)
+        self.by_host[machine.hostname] = machine
+        for component in machine.components:
+            component = component.lower()
+            self.by_component.setdefault(component, []).append(machine)
+            partition = self.get_partition(component)
+            if partition is not None:
+                partition_machines = self.by_partition.setdefault(partition, [])
+                if machine not in partition_machines:
+                    partition_machines.append(machine)
+        self.by_address = None
+
+    def get_machine(self, host):
+        '''
+        Returns the machine whose hostname is exactly host, or whose hostname resolves to the address host. None if there is no match
+        '''
+        if host in self.by_host:
+            return self.by_host[host]
+        if self.by_address is None:
+            by_address = {}
+            for machine in self.machines:
+                try:
+                    by_address[socket.gethostbyname(machine.hostname)] = machine
+                except socket.error:
+                    pass
+            self.by_address = by_address
+        return self.by_address.get(host)
+
+    def get_component_machines(self, component):
+        '''
+        Returns the list of machines running component, ie "clc" or "nc00"
+        '''
+        return list(self.by_component.get(component.lower(), []))
+
+    def get_partition_machines(self, partition):
+        '''
+        Returns the list of machines running a component of the partition, ie "PARTI00" or "00"
+        '''
+        return list(self.by_partition.get(self.get_partition(partition), []))
+
+    def get_components(self):
+        '''
+        Returns the list of every component name in the topology
+        '''
+        return self.by_component.keys()
@@ -0,0 +1,67 @@
+#!/usr/bin/python
+#
+# Checks that importing the tester modules stays cheap. Each module is imported in a fresh interpreter a few times,
+# the fastest import is compared against the budget and paramiko/boto must not have been loaded by the import.
+# Exits non zero if any module is over budget or pulls in a deferred dependency.
+#
+# example:
+#     ./import_time.py --budget 0.2
+#     ./import_time.py --module eucaops --runs 10
+
+import argparse
+import os
+import subprocess
+import sys
+
+DEFERRED = ["paramiko", "boto"]
+MODULES = ["eutester", "eucaops", "eutester.euproperties", "eutester.sshconnection"]
+
+PROBE = '''
+import sys, time
+start = time.time()
+__import__(%r)
+elapsed = time.time() - start
+loaded = [name for name in %r if name in sys.modules]
+print elapsed, ",".join(loaded)
+'''
+
+def time_import(module, pythonpath):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = pythonpath + os.pathsep + env.get("PYTHONPATH", "")
+    output = subprocess.Popen([sys.executable, "-c", PROBE % (module, DEFERRED)], env=env, stdout=subprocess.PIPE).communicate()[0]
+    fields = output.strip().split(" ", 1)
+    loaded = []
+    if len(fields) > 1 and fields[1]:
+        loaded = fields[1].split(",")
+    return float(fields[0]), loaded
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check the time taken to import the eutester modules against a budget.')
+    parser.add_argument("-b", "--budget", dest="budget", type=float,
+                      help="Seconds each module is allowed to take to import Default: 0.25", default=0.25)
+    parser.add_argument("-r", "--runs", dest="runs", type=int,
+                      help="Imports timed per module, the fastest is used Default: 5", default=5)
+    parser.add_argument("-m", "--module", dest="modules", action="append",
+                      help="Module to check, may be given more than once Default: " + ", ".join(MODULES))
+    parser.add_argument("-p", "--path", dest="path",
+                      help="Directory containing the eutester and eucaops packages Default: the root of this checkout",
+                      default=os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+    args = parser.parse_args()
+    failed = False
+    for module in args.modules or MODULES:
+        times = []
+        loaded = []
+        for run in xrange(args.runs):
+            elapsed, loaded = time_import(module, args.path)
+            times.append(elapsed)
+        best = min(times)
+        status = "OK"
+        if best > args.budget:
+            status = "OVER BUDGET"
+            failed = True
+        if loaded:
+            status += " loaded " + ", ".join(loaded) + " at import time"
+            failed = True
+        print "%-28s %.3fs (budget %.3fs) %s" % (module, best, args.budget, status)
+    if failed:
+        sys.exit(1)